@@ -1,7 +1,7 @@
 # this script sets up a Flask web application with various routes and Firebase integration
 
 import os
-from flask import Flask, jsonify
+from flask import Flask, jsonify, Response
 from flask_cors import CORS
 import firebase_admin
 from firebase_admin import credentials, firestore # for firebase integration
@@ -10,7 +10,6 @@ from dotenv import load_dotenv # for loading the environment variables
 # create the models directory if it doesn't exist
 MODELS_DIR = os.path.join(os.path.dirname(__file__), "saved_models")
 os.makedirs(MODELS_DIR, exist_ok=True)
-os.makedirs("debug", exist_ok=True) # for temporarily storing audio files during emotion analysis (they are deleted immediately after)
 
 # create the flask app
 app = Flask(__name__)
@@ -93,19 +92,33 @@ allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
 supports_credentials=True)
 
 # import the routes from the other files
-from routes.emotion_detection import register_emotion_routes
+from routes.emotion_detection import register_emotion_routes, warmup_status
 from routes.model_training import register_model_training_routes
+from routes.training_jobs import register_training_job_routes
 from routes.datasets import register_dataset_routes
 from routes.fuzzy_logic import register_fuzzy_logic_routes
 from routes.progress import progress_bp
+from routes.metrics import render_metrics
 
 # register the routes with the app
 register_emotion_routes(app)
 register_model_training_routes(app)
+register_training_job_routes(app)
 register_dataset_routes(app)
 register_fuzzy_logic_routes(app)
 app.register_blueprint(progress_bp)
 
+# latency histograms and queue gauges in the prometheus text format, for this worker process only
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+# readiness route for load balancers, unlike the index route it only reports ready once the emotion models are warmed up
+@app.route("/ready", methods=["HEAD", "GET"])
+def ready():
+    is_ready, status = warmup_status()
+    return status, (200 if is_ready else 503)
+
 # get the available modules from the database for viewing in the frontend
 @app.route("/api/modules", methods=["GET"])
 def get_available_modules():
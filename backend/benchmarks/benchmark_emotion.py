@@ -0,0 +1,310 @@
+# this script benchmarks the face, text and audio emotion endpoints through flask's test client
+# it sends synthetic images, texts and audio clips of several sizes and reports the p50/p95 latency,
+# throughput and peak memory of each modality as json, each modality runs in its own process so its peak memory is its own
+#
+# usage: python benchmarks/benchmark_emotion.py --output report.json
+#        python benchmarks/benchmark_emotion.py --write-baseline benchmarks/baselines/<machine>.json
+#        python benchmarks/benchmark_emotion.py --compare benchmarks/baselines/<machine>.json
+#
+# the prediction caches are turned off, so every request runs the model
+# the inputs are made in the parent process and passed to each worker as files, so a worker's peak memory is the
+# model and the requests rather than the making of a 4000x3000 image
+# baselines recorded with the real models are kept in benchmarks/baselines/, see the readme there
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import platform
+import resource
+import argparse
+import subprocess
+import threading
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODALITIES = ('face', 'text', 'audio')
+ENDPOINTS = {
+    'face': '/api/detect-emotion',
+    'text': '/api/detect-text-emotion',
+    'audio': '/api/detect-audio-emotion'
+}
+
+# the input sizes for each modality: image (width, height), text length in words and audio length in seconds
+SIZES = {
+    'face': {'small': (224, 224), 'medium': (1280, 720), 'large': (4000, 3000)},
+    'text': {'short': 12, 'medium': 120, 'long': 600},
+    'audio': {'short': 1.0, 'medium': 5.0, 'long': 30.0}
+}
+
+WORDS = ('i', 'feel', 'really', 'happy', 'sad', 'angry', 'about', 'the', 'news', 'today', 'and', 'it', 'was',
+         'surprising', 'that', 'everyone', 'seemed', 'so', 'calm', 'afraid', 'of', 'what', 'comes', 'next')
+
+
+# a jpeg of smooth colour gradients with some noise, so it compresses and decodes like a photo
+def synthetic_image(width, height, seed):
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+    pixels = (x * rng.random(3, dtype=np.float32) + y * rng.random(3, dtype=np.float32)) * 200
+    pixels += rng.standard_normal((height, width, 3), dtype=np.float32) * 12
+    stream = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(stream, 'JPEG', quality=90)
+    return stream.getvalue()
+
+
+def synthetic_text(words, seed):
+    rng = random.Random(seed)
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+# a wav of gliding tones with bursts and pauses, so voice activity trimming keeps a realistic share of it
+def synthetic_audio(seconds, seed, rate=16000):
+    import numpy as np
+    import soundfile as sf
+
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate), dtype=np.float32) / rate
+    audio = 0.3 * np.sin(2 * np.pi * (180 + 60 * np.sin(2 * np.pi * 0.5 * t)) * t)
+    audio *= (np.sin(2 * np.pi * 0.7 * t) > -0.3) # pauses between bursts
+    audio += rng.normal(0, 0.01, len(t))
+    stream = io.BytesIO()
+    sf.write(stream, audio.astype(np.float32), rate, format='WAV')
+    return stream.getvalue()
+
+
+# the contents of one synthetic input file
+def synthetic_input(modality, size, seed):
+    if modality == 'face':
+        return synthetic_image(*size, seed)
+    if modality == 'text':
+        return synthetic_text(size, seed).encode('utf-8')
+    return synthetic_audio(size, seed)
+
+
+# the number of different inputs made for each size, requests cycle through them
+def input_count(requests):
+    return max(1, min(requests, 8))
+
+
+# write the inputs for one modality to a folder, as <size name>_<number>, the same seed always gives the same inputs
+def write_inputs(modality, requests, seed, folder):
+    for size_name, size in SIZES[modality].items():
+        for i in range(input_count(requests)):
+            with open(os.path.join(folder, f"{size_name}_{i}"), 'wb') as f:
+                f.write(synthetic_input(modality, size, seed + i))
+
+
+# the request arguments for one input file's contents
+def make_request(modality, payload):
+    if modality == 'face':
+        return {'data': {'image': (io.BytesIO(payload), 'image.jpg')}}
+    if modality == 'text':
+        return {'json': {'text': payload.decode('utf-8')}}
+    return {'data': {'audio': (io.BytesIO(payload), 'audio.wav')}}
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024 # bytes on macos, kilobytes on linux
+
+
+# run the benchmark for one modality in this process and return its results, reading the inputs from the given folder
+def run_modality(modality, requests, warmup, concurrency, inputs_dir):
+    os.environ['EMOTION_CACHE_SIZE'] = '0'
+    sys.path.insert(0, BACKEND_DIR)
+    from flask import Flask
+    from routes.emotion_detection import register_emotion_routes, model_registry
+
+    app = Flask(__name__)
+    register_emotion_routes(app)
+    model_registry.get(modality) # load the model before timing anything
+    endpoint = ENDPOINTS[modality]
+
+    results = {}
+    for size_name, size in SIZES[modality].items():
+        payloads = []
+        for i in range(input_count(requests)):
+            with open(os.path.join(inputs_dir, f"{size_name}_{i}"), 'rb') as f:
+                payloads.append(make_request(modality, f.read()))
+
+        def send(client, i):
+            kwargs = payloads[i % len(payloads)]
+            if 'data' in kwargs: # file uploads are consumed by each request, so send a fresh stream every time
+                kwargs = {'data': {key: (io.BytesIO(stream.getvalue()), name) for key, (stream, name) in kwargs['data'].items()}}
+            started = time.perf_counter()
+            response = client.post(endpoint, **kwargs)
+            return time.perf_counter() - started, response.status_code
+
+        client = app.test_client()
+        for i in range(warmup):
+            send(client, i)
+
+        latencies = []
+        errors = 0
+        lock = threading.Lock()
+        counter = iter(range(requests))
+
+        def worker():
+            nonlocal errors
+            thread_client = app.test_client()
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                latency, status = send(thread_client, i)
+                with lock:
+                    latencies.append(latency)
+                    errors += status != 200
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        results[size_name] = {
+            'size': size,
+            'requests': requests,
+            'errors': errors,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+            'throughput_rps': round(requests / elapsed, 2)
+        }
+
+    return {'sizes': results, 'peak_rss_mb': round(peak_rss_mb(), 1)}
+
+
+# the versions and settings that affect the results, so reports from different setups are not compared by mistake
+def environment_info():
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'precision': os.environ.get('INFERENCE_PRECISION', 'fp32'),
+        'torch_threads': os.environ.get('INFERENCE_TORCH_THREADS', '0')
+    }
+    for package in ('torch', 'transformers', 'tokenizers', 'numpy', 'pillow'):
+        try:
+            from importlib.metadata import version
+            info[package] = version(package)
+        except Exception:
+            info[package] = None
+    return info
+
+
+# run each modality in a child process and collect the results
+def run_all(modalities, args):
+    report = {'environment': environment_info(), 'settings': {
+        'requests': args.requests, 'warmup': args.warmup, 'concurrency': args.concurrency, 'seed': args.seed
+    }, 'results': {}}
+
+    for modality in modalities:
+        print(f"Benchmarking {modality}...", file=sys.stderr)
+        inputs_dir = tempfile.mkdtemp(prefix=f"benchmark_{modality}_")
+        try:
+            write_inputs(modality, args.requests, args.seed, inputs_dir)
+            command = [sys.executable, os.path.abspath(__file__), '--worker', modality,
+                       '--requests', str(args.requests), '--warmup', str(args.warmup),
+                       '--concurrency', str(args.concurrency), '--inputs', inputs_dir]
+            result = subprocess.run(command, capture_output=True, text=True, cwd=BACKEND_DIR)
+        finally:
+            shutil.rmtree(inputs_dir, ignore_errors=True)
+        if result.returncode != 0:
+            report['results'][modality] = {'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed'}
+            continue
+        report['results'][modality] = json.loads(result.stdout.strip().splitlines()[-1])
+
+    return report
+
+
+# compare a report with a baseline, returning a line for each latency or throughput that got worse by more than the tolerance
+def find_regressions(report, baseline, tolerance):
+    regressions = []
+    for modality, result in report['results'].items():
+        base_result = baseline.get('results', {}).get(modality)
+        if not base_result or 'sizes' not in base_result or 'sizes' not in result:
+            continue
+        for size_name, figures in result['sizes'].items():
+            base = base_result['sizes'].get(size_name)
+            if not base:
+                continue
+            for key in ('p50_ms', 'p95_ms'):
+                if base[key] and figures[key] > base[key] * (1 + tolerance):
+                    regressions.append(f"{modality}/{size_name} {key}: {base[key]} -> {figures[key]}")
+            if base['throughput_rps'] and figures['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+                regressions.append(f"{modality}/{size_name} throughput_rps: {base['throughput_rps']} -> {figures['throughput_rps']}")
+        if base_result.get('peak_rss_mb') and result['peak_rss_mb'] > base_result['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{modality} peak_rss_mb: {base_result['peak_rss_mb']} -> {result['peak_rss_mb']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the emotion detection endpoints with synthetic inputs")
+    parser.add_argument('--modality', action='append', choices=MODALITIES, help="modality to benchmark (default: all)")
+    parser.add_argument('--requests', type=int, default=30, help="timed requests per input size")
+    parser.add_argument('--warmup', type=int, default=3, help="untimed requests per input size before timing")
+    parser.add_argument('--concurrency', type=int, default=1, help="number of requests in flight at once")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the synthetic inputs")
+    parser.add_argument('--output', help="file to write the json report to (printed if not given)")
+    parser.add_argument('--write-baseline', help="write the report as a baseline to this file")
+    parser.add_argument('--compare', help="baseline file to compare against, exits with 1 if anything regressed")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown before a result counts as a regression")
+    parser.add_argument('--worker', choices=MODALITIES, help=argparse.SUPPRESS)
+    parser.add_argument('--inputs', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_modality(args.worker, args.requests, args.warmup, max(1, args.concurrency), args.inputs)))
+        return
+
+    report = run_all(args.modality or MODALITIES, args)
+    output = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    if args.write_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.write_baseline)), exist_ok=True)
+        with open(args.write_baseline, 'w') as f:
+            f.write(output)
+    if not args.output and not args.write_baseline:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for key in ('torch', 'transformers', 'cpu_count', 'precision'):
+            if baseline.get('environment', {}).get(key) != report['environment'].get(key):
+                print(f"Note: {key} differs from the baseline ({baseline.get('environment', {}).get(key)} -> {report['environment'].get(key)})", file=sys.stderr)
+        regressions = find_regressions(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+# gunicorn settings for the production server, each one can be changed with an environment variable
+
+import os
+
+bind = "0.0.0.0:5000"
+workers = int(os.environ.get("GUNICORN_WORKERS", 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+
+# with shared model weights the app (and the models) are loaded once before the workers are forked,
+# so the memory-mapped weights are shared by every worker instead of being loaded once per worker
+preload_app = os.environ.get("SHARED_MODEL_WEIGHTS", "0") == "1"
+
+# with the app preloaded, the model warm-up waits until each worker has forked,
+# as torch's thread pools started in the parent process do not work in the forked children
+if preload_app:
+    os.environ.setdefault("WARMUP_AFTER_FORK", "1")
+
+    def post_fork(server, worker):
+        from routes.emotion_detection import start_warmup
+        start_warmup()
@@ -0,0 +1,250 @@
+# this script decodes uploaded audio in memory, without writing it to disk
+# the container is detected from the first bytes of the file, then the audio is decoded once and resampled once
+# wav, flac and mp3 are decoded with soundfile, webm and ogg are piped through ffmpeg, and mp4 is passed to ffmpeg as a file
+# silence can also be trimmed before analysis, so the model only runs on the parts of a clip that have sound in them
+
+import io
+import shutil
+import tempfile
+import subprocess
+import threading
+import numpy as np
+import soundfile as sf
+import soxr
+
+# containers that are sent to ffmpeg rather than soundfile when it is installed (ogg is usually opus from browsers, which soundfile often cannot read)
+FFMPEG_FORMATS = ('webm', 'ogg', 'mp4')
+
+# containers ffmpeg may need to seek in (mp4 files, as recorded by phones, often keep their index at the end of the file),
+# these are written to a temporary file rather than piped to ffmpeg
+SEEKABLE_FORMATS = ('mp4',)
+
+
+# raised when the audio cannot be decoded
+class AudioDecodeError(Exception):
+    pass
+
+
+# detect the container format from the first bytes of the file
+def sniff_audio_format(header):
+    header = bytes(header[:16])
+    if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+        return 'wav'
+    if header[:4] == b'fLaC':
+        return 'flac'
+    if header[:4] == b'OggS':
+        return 'ogg'
+    if header[:4] == b'\x1a\x45\xdf\xa3': # ebml header used by webm and matroska
+        return 'webm'
+    if header[4:8] == b'ftyp':
+        return 'mp4'
+    if header[:3] == b'ID3' or (len(header) > 1 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0):
+        return 'mp3'
+    return None
+
+
+def ffmpeg_command(target_rate, source='pipe:0'):
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise AudioDecodeError('ffmpeg is required to decode this audio format but it is not installed.')
+    # read from stdin (or a file) and write mono 32-bit float samples at the target rate to stdout
+    return [ffmpeg, '-hide_banner', '-loglevel', 'error', '-i', source,
+            '-f', 'f32le', '-ac', '1', '-ar', str(target_rate), 'pipe:1']
+
+
+# decode with ffmpeg from a temporary file, for containers that cannot be read from a pipe
+def decode_with_ffmpeg_from_file(data, target_rate):
+    with tempfile.NamedTemporaryFile(suffix='.audio') as temp_file:
+        temp_file.write(data)
+        temp_file.flush()
+        return subprocess.run(ffmpeg_command(target_rate, temp_file.name), stdin=subprocess.DEVNULL, capture_output=True)
+
+
+# decode with ffmpeg, which also resamples to the target rate
+def decode_with_ffmpeg(data, target_rate):
+    if sniff_audio_format(data) in SEEKABLE_FORMATS:
+        result = decode_with_ffmpeg_from_file(data, target_rate)
+    else:
+        result = subprocess.run(ffmpeg_command(target_rate), input=data, capture_output=True)
+        if result.returncode != 0 or not result.stdout:
+            # some containers can only be read when ffmpeg can seek in them, so try again from a file
+            result = decode_with_ffmpeg_from_file(data, target_rate)
+    if result.returncode != 0 or not result.stdout:
+        raise AudioDecodeError(f"ffmpeg could not decode the audio: {result.stderr.decode('utf-8', 'replace').strip()}")
+    return np.frombuffer(result.stdout[:len(result.stdout) // 4 * 4], dtype=np.float32)
+
+
+# decode with soundfile, then mix down to mono and resample once
+def decode_with_soundfile(data, target_rate):
+    audio, rate = sf.read(io.BytesIO(data), dtype='float32', always_2d=True)
+    audio = audio.mean(axis=1)
+    if rate != target_rate:
+        audio = soxr.resample(audio, rate, target_rate)
+    return audio.astype(np.float32, copy=False)
+
+
+# decode a whole audio file held in memory to mono float32 samples at the target rate
+def decode_audio(data, target_rate=16000):
+    if not data:
+        raise AudioDecodeError('The audio file is empty.')
+
+    if sniff_audio_format(data) in FFMPEG_FORMATS and shutil.which('ffmpeg'):
+        return decode_with_ffmpeg(data, target_rate)
+
+    try:
+        return decode_with_soundfile(data, target_rate)
+    except Exception as sf_error:
+        # formats soundfile does not recognise (or older builds without mp3 support) fall back to ffmpeg
+        if shutil.which('ffmpeg') is None:
+            raise AudioDecodeError(f'Could not decode the audio (installing ffmpeg adds support for more formats): {str(sf_error)}') from sf_error
+        return decode_with_ffmpeg(data, target_rate)
+
+
+# read an open sound file block by block, yielding mono audio resampled to the target rate
+def iter_soundfile_blocks(sound_file, target_rate, block_seconds):
+    with sound_file:
+        resampler = None
+        if sound_file.samplerate != target_rate:
+            resampler = soxr.ResampleStream(sound_file.samplerate, target_rate, 1, dtype='float32')
+
+        block_size = max(1, int(block_seconds * sound_file.samplerate))
+        while True:
+            block = sound_file.read(block_size, dtype='float32', always_2d=True)
+            last = len(block) < block_size
+            mono = block.mean(axis=1).astype(np.float32)
+            if resampler is not None:
+                mono = resampler.resample_chunk(mono, last=last)
+            if len(mono):
+                yield mono
+            if last:
+                break
+
+
+# pipe a file-like object through ffmpeg, yielding blocks of mono audio at the target rate as they are decoded
+# containers ffmpeg needs to seek in are copied to a temporary file first and ffmpeg reads that instead
+def iter_ffmpeg_blocks(source, target_rate, block_seconds, seekable=False):
+    if seekable:
+        with tempfile.NamedTemporaryFile(suffix='.audio') as temp_file:
+            shutil.copyfileobj(source, temp_file, 64 * 1024)
+            temp_file.flush()
+            yield from iter_ffmpeg_process_blocks(ffmpeg_command(target_rate, temp_file.name), None, target_rate, block_seconds)
+    else:
+        yield from iter_ffmpeg_process_blocks(ffmpeg_command(target_rate), source, target_rate, block_seconds)
+
+
+# the last part of what ffmpeg wrote to its error log, for the error message
+def read_error_log(error_log, limit=4096):
+    error_log.seek(0, io.SEEK_END)
+    error_log.seek(max(0, error_log.tell() - limit))
+    return error_log.read().decode('utf-8', 'replace').strip()
+
+
+# run ffmpeg, feeding it the source (when there is one) and yielding blocks of the decoded audio
+# ffmpeg's messages go to a temporary file rather than a pipe, as a pipe that is not read while the audio is being read
+# fills up on a badly damaged file and leaves ffmpeg (and the request) waiting forever
+def iter_ffmpeg_process_blocks(command, source, target_rate, block_seconds):
+    error_log = tempfile.TemporaryFile()
+    process = subprocess.Popen(command, stdin=subprocess.PIPE if source is not None else subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=error_log)
+
+    # feed the input on a separate thread so ffmpeg never blocks on a full output pipe
+    def feed():
+        try:
+            shutil.copyfileobj(source, process.stdin, 64 * 1024)
+        except (BrokenPipeError, ValueError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    feeder = None
+    if source is not None:
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+    block_bytes = max(1, int(block_seconds * target_rate)) * 4
+    decoded_any = False
+    try:
+        while True:
+            chunk = process.stdout.read(block_bytes)
+            if not chunk:
+                break
+            decoded_any = True
+            yield np.frombuffer(chunk[:len(chunk) // 4 * 4], dtype=np.float32)
+
+        process.wait()
+        if process.returncode != 0 and not decoded_any:
+            raise AudioDecodeError(f"ffmpeg could not decode the audio: {read_error_log(error_log)}")
+    finally:
+        # stop ffmpeg if the client goes away before the end of the stream
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if feeder is not None:
+            feeder.join(timeout=1)
+        error_log.close()
+
+
+# open a seekable file-like object for block by block decoding
+# soundfile formats are opened straight away so that unreadable audio is reported before any output is produced
+def open_audio_blocks(source, target_rate=16000, block_seconds=10.0):
+    header = source.read(16)
+    source.seek(0)
+    if not header:
+        raise AudioDecodeError('The audio file is empty.')
+
+    audio_format = sniff_audio_format(header)
+    if audio_format in FFMPEG_FORMATS and shutil.which('ffmpeg'):
+        return iter_ffmpeg_blocks(source, target_rate, block_seconds, seekable=audio_format in SEEKABLE_FORMATS)
+
+    try:
+        sound_file = sf.SoundFile(source)
+    except Exception as sf_error:
+        if shutil.which('ffmpeg') is None:
+            raise AudioDecodeError(f'Could not decode the audio (installing ffmpeg adds support for more formats): {str(sf_error)}') from sf_error
+        source.seek(0)
+        return iter_ffmpeg_blocks(source, target_rate, block_seconds)
+    return iter_soundfile_blocks(sound_file, target_rate, block_seconds)
+
+
+# find the stretches of a clip that contain sound, as (start, end) sample ranges
+# a frame counts as silent when it is more than top_db quieter than the loudest frame, or quieter than floor_db overall
+# silent gaps shorter than min_gap_seconds are kept, and each stretch is padded slightly so word edges are not cut off
+def voiced_intervals(audio, rate, top_db=40.0, floor_db=-60.0, frame_seconds=0.025,
+                     min_gap_seconds=0.3, padding_seconds=0.1):
+    if not len(audio):
+        return []
+
+    frame_size = max(1, int(frame_seconds * rate))
+    frames = np.pad(audio, (0, -len(audio) % frame_size)).reshape(-1, frame_size)
+    levels = 20 * np.log10(np.maximum(np.sqrt((frames.astype(np.float64) ** 2).mean(axis=1)), 1e-10))
+    voiced = np.flatnonzero((levels > levels.max() - top_db) & (levels > floor_db))
+    if not len(voiced):
+        return []
+
+    # split the voiced frames wherever the gap between them is long enough to count as a pause
+    min_gap_frames = max(1, int(min_gap_seconds / frame_seconds))
+    breaks = np.flatnonzero(np.diff(voiced) > min_gap_frames)
+    starts = np.concatenate([[voiced[0]], voiced[breaks + 1]])
+    ends = np.concatenate([voiced[breaks], [voiced[-1]]]) + 1
+
+    padding = int(padding_seconds * rate)
+    intervals = []
+    for start, end in zip(starts * frame_size, ends * frame_size):
+        start, end = max(0, start - padding), min(len(audio), end + padding)
+        if intervals and start <= intervals[-1][1]:
+            intervals[-1] = (intervals[-1][0], end) # the padding made two stretches touch, so join them
+        else:
+            intervals.append((start, end))
+    return intervals
+
+
+# keep only the parts of a clip with sound in them, joined together and cut off after max_seconds (0 means no limit)
+def trim_to_voiced(audio, rate, top_db=40.0, max_seconds=0):
+    intervals = voiced_intervals(audio, rate, top_db=top_db) if top_db > 0 else [(0, len(audio))]
+    trimmed = np.concatenate([audio[start:end] for start, end in intervals]) if intervals else audio[:0]
+    if max_seconds > 0:
+        trimmed = trimmed[:int(max_seconds * rate)]
+    return trimmed
@@ -0,0 +1,89 @@
+# this script keeps processed datasets on the server, so training requests can refer to an uploaded dataset by its id
+# rather than sending every row back each time
+# datasets are saved as parquet files named by a hash of their contents, so uploading the same data twice gives the same id,
+# and they are deleted once they have not been used for DATASET_TTL_SECONDS
+
+import os
+import re
+import json
+import time
+import uuid
+import tempfile
+import pandas as pd
+
+from routes.result_cache import make_cache_key
+
+# where the datasets are kept, this should be shared by every gunicorn worker and training process
+DATASET_STORE_DIR = os.environ.get("DATASET_STORE_DIR", os.path.join(tempfile.gettempdir(), "datasets"))
+DATASET_TTL_SECONDS = float(os.environ.get("DATASET_TTL_SECONDS", 6 * 3600))
+
+
+def dataset_path(dataset_id):
+    if not isinstance(dataset_id, str) or not re.fullmatch(r'[0-9a-f]{32}', dataset_id):
+        return None # ids are generated by us, so anything else cannot be a dataset
+    return os.path.join(DATASET_STORE_DIR, f"{dataset_id}.parquet")
+
+
+# change category columns back to the type of their values, so a stored dataset trains exactly like the same rows sent as json
+def normalise_dtypes(df):
+    df = df.reset_index(drop=True)
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(df[col].cat.categories.dtype)
+    return df
+
+
+# delete the datasets that have not been used for longer than the time to live
+def remove_expired_datasets():
+    if not os.path.isdir(DATASET_STORE_DIR):
+        return
+    cutoff = time.time() - DATASET_TTL_SECONDS
+    for name in os.listdir(DATASET_STORE_DIR):
+        path = os.path.join(DATASET_STORE_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass # another worker removed it first
+
+
+# save a dataset and return its id
+def save_dataset(df):
+    df = normalise_dtypes(df)
+    dataset_id = make_cache_key(
+        json.dumps([[str(col), str(dtype)] for col, dtype in df.dtypes.items()]),
+        pd.util.hash_pandas_object(df, index=False).values.tobytes()
+    )[:32]
+
+    remove_expired_datasets()
+    os.makedirs(DATASET_STORE_DIR, exist_ok=True)
+    path = dataset_path(dataset_id)
+    if os.path.exists(path):
+        os.utime(path) # the same data was uploaded before, so keep it for longer instead of writing it again
+        return dataset_id
+
+    # the same data can be uploaded by several requests at once, so each writes its own temporary file
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        df.to_parquet(temp_path, index=False)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path): # writing it failed, so do not leave it behind
+            os.remove(temp_path)
+    return dataset_id
+
+
+# load a stored dataset, or None if there is no dataset with this id (or it has expired)
+def load_dataset(dataset_id):
+    path = dataset_path(dataset_id)
+    if path is None:
+        return None
+    try:
+        df = pd.read_parquet(path)
+    except FileNotFoundError:
+        return None
+    try:
+        os.utime(path) # using a dataset keeps it for another time to live
+    except OSError:
+        pass
+    return df
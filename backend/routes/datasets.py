@@ -6,6 +6,8 @@ import numpy as np  # for numerical operations
 from flask import jsonify, request  # for handling http requests and responses
 import chardet  # for detecting file encoding
 
+from routes.dataset_store import save_dataset  # for keeping the processed dataset on the server
+
 # processes an uploaded csv file for machine learning
 # performs data cleaning, encoding, and feature engineering
 # returns processed data and metadata for model training
@@ -147,9 +149,17 @@ def process_csv():
             unique_counts = {col: df[col].nunique() for col in df.columns if col in df}
             suitable_targets = [col for col, count in unique_counts.items() if count <= 5]
             
+            # keep the processed dataset on the server, so training can refer to it by id instead of receiving every row again
+            try:
+                dataset_id = save_dataset(combined_df)
+            except Exception as e:
+                print(f"Could not store the processed dataset, training will need the rows sent with it: {str(e)}")
+                dataset_id = None
+
             # return processed data and metadata for model training
             return jsonify({
                 'data': data,  # the processed dataset
+                'dataset_id': dataset_id,  # the id of the stored dataset, to send with training requests
                 'features': original_features,  # original column names
                 'all_columns': combined_df.columns.tolist(),  # all columns including encoded ones
                 'suitable_targets': suitable_targets,  # columns suitable as target variables
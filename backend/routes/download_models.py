@@ -37,7 +37,7 @@ try:
     processor_dir = os.path.join(base_dir, "face_emotion_processor")
     os.makedirs(model_dir, exist_ok=True)
     os.makedirs(processor_dir, exist_ok=True)
-    model.save_pretrained(model_dir)
+    model.save_pretrained(model_dir, safe_serialization=True) # safetensors weights can be memory-mapped when loading
     processor.save_pretrained(processor_dir)
     print("Facial emotion models downloaded")
 
@@ -49,7 +49,7 @@ try:
     text_tokenizer_dir = os.path.join(base_dir, "text_emotion_tokenizer")
     os.makedirs(text_model_dir, exist_ok=True)
     os.makedirs(text_tokenizer_dir, exist_ok=True)
-    text_model.save_pretrained(text_model_dir)
+    text_model.save_pretrained(text_model_dir, safe_serialization=True)
     text_tokenizer.save_pretrained(text_tokenizer_dir)
     print("Text emotion models downloaded")
 
@@ -61,7 +61,7 @@ try:
     audio_extractor_dir = os.path.join(base_dir, "audio_emotion_extractor")
     os.makedirs(audio_model_dir, exist_ok=True)
     os.makedirs(audio_extractor_dir, exist_ok=True)
-    audio_model.save_pretrained(audio_model_dir)
+    audio_model.save_pretrained(audio_model_dir, safe_serialization=True)
     audio_extractor.save_pretrained(audio_extractor_dir)
     print("Audio emotion models downloaded")
 
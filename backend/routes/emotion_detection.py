@@ -4,17 +4,29 @@
 import os
 import io
 import base64
+import json
+import tempfile
 import traceback
-from flask import request, jsonify
-from werkzeug.utils import secure_filename
-from PIL import Image
-import librosa
+import threading
+import unicodedata
+from concurrent.futures import Future
+from flask import request, jsonify, Response, stream_with_context
 import torch
 from transformers import AutoImageProcessor, AutoModelForImageClassification
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 from transformers import AutoFeatureExtractor, AutoModelForAudioClassification
 import numpy as np
-import soundfile as sf
+from routes.audio_decoding import decode_audio, open_audio_blocks, trim_to_voiced
+from routes.image_decoding import ImageTooLargeError, decode_base64_to_stream, open_downscaled_image, processor_target_size
+from routes.inference_batching import MicroBatcher
+from routes.inference_executor import InferenceExecutor, InferenceQueueFull
+from routes.metrics import Histogram, register_collector, render_samples
+from routes.model_bundle import open_bundle
+from routes.model_registry import ModelRegistry
+from routes.quantization import apply_precision, cast_inputs
+from routes.result_cache import ResultCache, make_cache_key
+from routes.shared_weights import load_model_with_shared_weights
+from routes.video_decoding import VideoDecodeError, iter_distinct_frames, iter_video_frames
 
 # paths to the models
 MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "saved_models")
@@ -24,75 +36,450 @@ TEXT_MODEL_DIR = os.path.join(MODELS_DIR, "text_emotion_model")
 TEXT_TOKENIZER_DIR = os.path.join(MODELS_DIR, "text_emotion_tokenizer")
 AUDIO_MODEL_DIR = os.path.join(MODELS_DIR, "audio_emotion_model")
 AUDIO_EXTRACTOR_DIR = os.path.join(MODELS_DIR, "audio_emotion_extractor")
-
-# initialise the variables for our ai models, these will be loaded when needed
-processor = None
-model = None
-text_tokenizer = None
-text_model = None
-audio_extractor = None
-audio_model = None
+MODEL_BUNDLE_DIR = os.path.join(MODELS_DIR, "bundle")
 
 # decide whether running in development or production
 ENV = os.environ.get("ENVIRONMENT", "development")
 
-# load the models
-def load_models():
-    global processor, model, text_tokenizer, text_model, audio_extractor, audio_model
-    
+# memory budget in megabytes for the loaded models (0 means no limit), the least recently used model is unloaded when it is exceeded
+MODEL_MEMORY_BUDGET_MB = float(os.environ.get("MODEL_MEMORY_BUDGET_MB", 0))
+
+# load the models from the packed bundle (made by pack_models.py) when there is one, and whether to check its checksums at startup
+USE_MODEL_BUNDLE = os.environ.get("USE_MODEL_BUNDLE", "1") == "1"
+MODEL_BUNDLE_VERIFY = os.environ.get("MODEL_BUNDLE_VERIFY", "0") == "1"
+
+# memory-map the safetensors weights so gunicorn workers forked after preloading share one copy of them (fp32 only)
+SHARED_MODEL_WEIGHTS = os.environ.get("SHARED_MODEL_WEIGHTS", "0") == "1"
+
+# run a synthetic input through each preloaded model at startup, so the first real request does not pay for initialisation
+# /ready reports not ready until this has finished
+WARMUP_ON_START = os.environ.get("WARMUP_ON_START", "0") == "1"
+
+# set by gunicorn.conf.py when the app is preloaded, the warm-up then waits until each worker has forked,
+# as torch's thread pools started in the parent process do not work in the forked children
+WARMUP_AFTER_FORK = os.environ.get("WARMUP_AFTER_FORK", "0") == "1"
+
+# comma-separated list of models to load at startup (face, text, audio or all), the rest are loaded on first use
+# with shared weights or warm-up everything is preloaded by default, as models loaded later are neither shared nor warmed up
+PRELOAD_MODELS = os.environ.get("PRELOAD_MODELS", "all" if SHARED_MODEL_WEIGHTS or WARMUP_ON_START else "")
+
+# precision the models are served at on cpu: fp32 (default), int8 (dynamic quantization) or bf16
+INFERENCE_PRECISION = os.environ.get("INFERENCE_PRECISION", "fp32").lower()
+
+# settings for batching concurrent text requests into one forward pass
+TEXT_BATCH_MAX_SIZE = int(os.environ.get("TEXT_BATCH_MAX_SIZE", 16))
+TEXT_BATCH_MAX_WAIT_MS = float(os.environ.get("TEXT_BATCH_MAX_WAIT_MS", 10))
+
+# settings for the bulk text endpoint, texts are padded in buckets of similar token length
+TEXT_BUCKET_SIZE = int(os.environ.get("TEXT_BUCKET_SIZE", 32))
+TEXT_BULK_MAX_ITEMS = int(os.environ.get("TEXT_BULK_MAX_ITEMS", 5000))
+
+# settings for long texts in chunked mode, split into windows of at most this many tokens that overlap by the stride
+TEXT_CHUNK_TOKENS = int(os.environ.get("TEXT_CHUNK_TOKENS", 512))
+TEXT_CHUNK_STRIDE = int(os.environ.get("TEXT_CHUNK_STRIDE", 64))
+
+# settings for the prediction cache, repeated inputs return the cached predictions without running the model
+EMOTION_CACHE_SIZE = int(os.environ.get("EMOTION_CACHE_SIZE", 1024))
+EMOTION_CACHE_TTL_SECONDS = float(os.environ.get("EMOTION_CACHE_TTL_SECONDS", 3600))
+
+# the largest image (in pixels) that will be decoded, larger uploads are rejected before their pixels are read
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 40_000_000))
+
+# the sample rate the audio model expects, uploads are resampled to this once while decoding
+AUDIO_SAMPLE_RATE = 16000
+
+# silence more than this many decibels below the loudest part of a clip is trimmed before analysis (0 turns trimming off)
+# and at most this many seconds of the remaining audio are analysed (0 means no limit)
+AUDIO_VAD_TOP_DB = float(os.environ.get("AUDIO_VAD_TOP_DB", 40.0))
+AUDIO_MAX_ANALYSED_SECONDS = float(os.environ.get("AUDIO_MAX_ANALYSED_SECONDS", 30.0))
+
+# settings for the audio timeline, long clips are decoded in blocks and analysed in overlapping windows
+AUDIO_WINDOW_SECONDS = float(os.environ.get("AUDIO_WINDOW_SECONDS", 5.0))
+AUDIO_WINDOW_HOP_SECONDS = float(os.environ.get("AUDIO_WINDOW_HOP_SECONDS", 2.5))
+AUDIO_WINDOW_BATCH_SIZE = int(os.environ.get("AUDIO_WINDOW_BATCH_SIZE", 8))
+AUDIO_DECODE_BLOCK_SECONDS = float(os.environ.get("AUDIO_DECODE_BLOCK_SECONDS", 10.0))
+
+# settings for the video endpoint, frames are sampled at a fixed rate (which a request can lower or raise up to the maximum)
+# and a frame is skipped when it differs from the last analysed frame by no more than the threshold (0 to 255)
+# ffmpeg is stopped if a video takes longer than the timeout to decode and analyse
+VIDEO_SAMPLE_FPS = float(os.environ.get("VIDEO_SAMPLE_FPS", 2.0))
+VIDEO_MAX_SAMPLE_FPS = float(os.environ.get("VIDEO_MAX_SAMPLE_FPS", 10.0))
+VIDEO_MAX_FRAMES = int(os.environ.get("VIDEO_MAX_FRAMES", 600))
+VIDEO_FRAME_DIFF_THRESHOLD = float(os.environ.get("VIDEO_FRAME_DIFF_THRESHOLD", 4.0))
+VIDEO_BATCH_SIZE = int(os.environ.get("VIDEO_BATCH_SIZE", 16))
+VIDEO_DECODE_TIMEOUT_SECONDS = float(os.environ.get("VIDEO_DECODE_TIMEOUT_SECONDS", 120))
+
+# the models name some emotions differently, so their labels are mapped onto one set before they are fused
+EMOTION_LABEL_ALIASES = {
+    'angry': 'anger', 'happy': 'joy', 'happiness': 'joy', 'sad': 'sadness', 'fearful': 'fear',
+    'surprised': 'surprise', 'disgusted': 'disgust', 'calm': 'neutral'
+}
+
+# the number of threads torch uses inside each forward pass (0 keeps torch's default of one per core)
+# this is shared by the whole process, so with several inference workers it should be roughly cores / total workers
+INFERENCE_TORCH_THREADS = int(os.environ.get("INFERENCE_TORCH_THREADS", 0))
+
+# how many forward passes of each modality run at once, and how many more can wait before requests are turned away
+FACE_INFERENCE_WORKERS = int(os.environ.get("FACE_INFERENCE_WORKERS", 1))
+FACE_INFERENCE_QUEUE = int(os.environ.get("FACE_INFERENCE_QUEUE", 8))
+TEXT_INFERENCE_WORKERS = int(os.environ.get("TEXT_INFERENCE_WORKERS", 1))
+TEXT_INFERENCE_QUEUE = int(os.environ.get("TEXT_INFERENCE_QUEUE", 64))
+AUDIO_INFERENCE_WORKERS = int(os.environ.get("AUDIO_INFERENCE_WORKERS", 1))
+AUDIO_INFERENCE_QUEUE = int(os.environ.get("AUDIO_INFERENCE_QUEUE", 4))
+
+if INFERENCE_TORCH_THREADS > 0:
+    torch.set_num_threads(INFERENCE_TORCH_THREADS)
+
+# the time spent decoding, preprocessing, running and postprocessing each input (or each batch, for batched models)
+inference_stage_seconds = Histogram(
+    'emotion_inference_stage_seconds',
+    'Time spent in each stage of emotion inference, per request or per batch',
+    ('modality', 'stage')
+)
+
+# time the body of a with block as one stage of a modality's inference
+def time_stage(modality, stage):
+    return inference_stage_seconds.time(modality=modality, stage=stage)
+
+# the manifest of the packed model bundle, or None to load the separate folders saved by download_models.py
+# a damaged bundle is reported and the separate folders are used instead
+try:
+    model_bundle = open_bundle(MODEL_BUNDLE_DIR, verify=MODEL_BUNDLE_VERIFY) if USE_MODEL_BUNDLE else None
+except Exception as e:
+    print(f"Error opening the model bundle, loading the downloaded model folders instead: {e}")
+    model_bundle = None
+
+# the folders each modality's model and processor are loaded from
+if model_bundle is not None:
+    MODEL_FILE_DIRS = {name: (os.path.join(MODEL_BUNDLE_DIR, name),) * 2 for name in ('face', 'text', 'audio')}
+else:
+    MODEL_FILE_DIRS = {
+        'face': (FACE_MODEL_DIR, FACE_PROCESSOR_DIR),
+        'text': (TEXT_MODEL_DIR, TEXT_TOKENIZER_DIR),
+        'audio': (AUDIO_MODEL_DIR, AUDIO_EXTRACTOR_DIR)
+    }
+
+# load a model at the requested precision, memory-mapping its weights when they are shared between workers
+# weights in the bundle are always memory-mapped, as they are known to be safetensors
+def load_classifier(model_class, model_dir, precision=None, **kwargs):
+    precision = precision or INFERENCE_PRECISION
+    if (SHARED_MODEL_WEIGHTS or model_bundle is not None) and precision == 'fp32':
+        return load_model_with_shared_weights(model_class, model_dir)
+
+    model = model_class.from_pretrained(
+        model_dir,
+        local_files_only=(ENV != "production"), # only load the local files if not in production, to speed up loading
+        **kwargs
+    )
+    return apply_precision(model, precision)
+
+# load the face model and processor
+def load_face_model(precision=None):
+    model_dir, processor_dir = MODEL_FILE_DIRS['face']
+    if not (os.path.exists(model_dir) and os.path.exists(processor_dir)):
+        raise FileNotFoundError(f"Face emotion model not found in {model_dir}. Please run download_models.py first.")
+
     try:
-        # load the face model and processor
-        if os.path.exists(FACE_MODEL_DIR) and os.path.exists(FACE_PROCESSOR_DIR):
-            processor = AutoImageProcessor.from_pretrained(
-                FACE_PROCESSOR_DIR,
-                local_files_only=(ENV != "production") # only load the local files if not in production, to speed up loading
-            )
-            model = AutoModelForImageClassification.from_pretrained(
-                FACE_MODEL_DIR,
-                local_files_only=(ENV != "production")
-            )
-        else:
-            error_msg = f"Face emotion model not found in {FACE_MODEL_DIR}. Please run download_models.py first."
-            raise FileNotFoundError(error_msg)
-
-        # load the text model and tokenizer
-        if os.path.exists(TEXT_MODEL_DIR) and os.path.exists(TEXT_TOKENIZER_DIR):
-            text_tokenizer = AutoTokenizer.from_pretrained(
-                TEXT_TOKENIZER_DIR,
-                local_files_only=(ENV != "production"),
-                use_fast=(ENV == "production")
-            )
-            text_model = AutoModelForSequenceClassification.from_pretrained(
-                TEXT_MODEL_DIR,
-                local_files_only=(ENV != "production")
-            )
-        else:
-            error_msg = f"Text emotion model not found in {TEXT_MODEL_DIR}. Please run download_models.py first."
-            raise FileNotFoundError(error_msg)
-
-        # load the audio model and extractor
-        if os.path.exists(AUDIO_MODEL_DIR) and os.path.exists(AUDIO_EXTRACTOR_DIR):
-            audio_extractor = AutoFeatureExtractor.from_pretrained(
-                AUDIO_EXTRACTOR_DIR,
-                local_files_only=(ENV != "production")
-            )
-            audio_model = AutoModelForAudioClassification.from_pretrained(
-                AUDIO_MODEL_DIR,
-                local_files_only=(ENV != "production"),
-                use_safetensors=True # for improved security and efficiency
-            )
-        else:
-            error_msg = f"Audio emotion model not found in {AUDIO_MODEL_DIR}. Please run download_models.py first."
-            raise FileNotFoundError(error_msg)
+        processor = AutoImageProcessor.from_pretrained(
+            processor_dir,
+            local_files_only=(ENV != "production") # only load the local files if not in production, to speed up loading
+        )
+        model = load_classifier(AutoModelForImageClassification, model_dir, precision)
+    except Exception as e:
+        raise RuntimeError(f"An unexpected error occurred while loading the face model: {e}") from e
+    return processor, model
+
+# load the text model and tokenizer
+def load_text_model(precision=None):
+    model_dir, tokenizer_dir = MODEL_FILE_DIRS['text']
+    if not (os.path.exists(model_dir) and os.path.exists(tokenizer_dir)):
+        raise FileNotFoundError(f"Text emotion model not found in {model_dir}. Please run download_models.py first.")
 
-    except FileNotFoundError as e:
-        raise e
+    try:
+        text_tokenizer = AutoTokenizer.from_pretrained(
+            tokenizer_dir,
+            local_files_only=(ENV != "production"),
+            use_fast=True # the fast tokenizer is needed for the character offsets of long text chunks
+        )
+        text_model = load_classifier(AutoModelForSequenceClassification, model_dir, precision)
     except Exception as e:
-        raise RuntimeError(f"An unexpected error occurred during model loading: {e}") from e
+        raise RuntimeError(f"An unexpected error occurred while loading the text model: {e}") from e
+    return text_tokenizer, text_model
+
+# load the audio model and extractor
+def load_audio_model(precision=None):
+    model_dir, extractor_dir = MODEL_FILE_DIRS['audio']
+    if not (os.path.exists(model_dir) and os.path.exists(extractor_dir)):
+        raise FileNotFoundError(f"Audio emotion model not found in {model_dir}. Please run download_models.py first.")
+
+    try:
+        audio_extractor = AutoFeatureExtractor.from_pretrained(
+            extractor_dir,
+            local_files_only=(ENV != "production")
+        )
+        audio_model = load_classifier(
+            AutoModelForAudioClassification, model_dir, precision,
+            use_safetensors=True # for improved security and efficiency
+        )
+    except Exception as e:
+        raise RuntimeError(f"An unexpected error occurred while loading the audio model: {e}") from e
+    return audio_extractor, audio_model
+
+# identify the version of a modality's model files and precision, so cached predictions are not reused after the model changes
+# this lists and reads the details of every file, so it is only called when the model is loaded
+def read_model_revision(modality):
+    parts = [INFERENCE_PRECISION]
+    if model_bundle is not None:
+        return make_cache_key(*parts, model_bundle['models'][modality]['revision'])
+    for directory in MODEL_FILE_DIRS[modality]:
+        try:
+            for name in sorted(os.listdir(directory)):
+                stat = os.stat(os.path.join(directory, name))
+                parts.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            parts.append(f"{directory}:missing")
+    return make_cache_key(*parts)
+
+# each modality is loaded the first time it is used, and unloaded again if the memory budget is exceeded
+model_registry = ModelRegistry(memory_budget_mb=MODEL_MEMORY_BUDGET_MB)
+model_registry.register('face', load_face_model, revision=lambda: read_model_revision('face'))
+model_registry.register('text', load_text_model, revision=lambda: read_model_revision('text'))
+model_registry.register('audio', load_audio_model, revision=lambda: read_model_revision('audio'))
+
+# load the models named in the preload list, so the ones we know are needed are ready for the first request
+def load_models(names=None):
+    if names is None:
+        names = PRELOAD_MODELS
+    if isinstance(names, str):
+        names = [name.strip() for name in names.split(',') if name.strip()]
+    if 'all' in names:
+        names = model_registry.names()
 
-# load the models
+    for name in names:
+        if name not in model_registry.names():
+            raise ValueError(f"Unknown model in preload list: {name}")
+        model_registry.get(name)
+
+# load the preloaded models
 load_models()
 
+# one prediction cache per modality, keyed by a hash of the input and the model revision
+result_caches = {
+    name: ResultCache(maxsize=EMOTION_CACHE_SIZE, ttl=EMOTION_CACHE_TTL_SECONDS)
+    for name in ('face', 'text', 'audio')
+}
+
+# the revision of a modality's model, read when the model was loaded, for the prediction cache keys
+def model_revision(modality):
+    return model_registry.revision(modality)
+
+# normalise text before it is cached and classified, so the same sentence with different spacing shares a cache entry
+def normalise_text(text):
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+# the response for a modality whose model cannot be loaded
+def model_unavailable_response(modality, error):
+    return jsonify({
+        'error': f'{modality.capitalize()} emotion detection model not loaded',
+        'details': f'{str(error)} Run python download_models.py to download all required models.'
+    }), 503
+
+# run the text model on a list of texts, returning the probabilities for each text in the original order
+# texts are tokenized once, sorted by token length and padded in buckets, so short texts are not padded to the longest one
+def classify_text_batch(texts, bucket_size=TEXT_BUCKET_SIZE, models=None):
+    text_tokenizer, text_model = models or model_registry.get('text')
+    with time_stage('text', 'preprocess'):
+        encodings = text_tokenizer(list(texts), truncation=True, max_length=512)
+        input_ids = encodings['input_ids']
+        attention_mask = encodings['attention_mask']
+
+        order = sorted(range(len(texts)), key=lambda i: len(input_ids[i]))
+        buckets = []
+        for start in range(0, len(order), max(1, bucket_size)):
+            bucket = order[start:start + bucket_size]
+            inputs = text_tokenizer.pad(
+                {'input_ids': [input_ids[i] for i in bucket], 'attention_mask': [attention_mask[i] for i in bucket]},
+                return_tensors="pt"
+            )
+            buckets.append((bucket, inputs))
+
+    probabilities = [None] * len(texts)
+    with torch.no_grad(), time_stage('text', 'forward'):
+        for bucket, inputs in buckets:
+            outputs = text_model(**cast_inputs(inputs, text_model))
+            bucket_probabilities = torch.nn.functional.softmax(outputs.logits.float(), dim=1)
+
+            for i, row in zip(bucket, bucket_probabilities):
+                probabilities[i] = row
+
+    return probabilities
+
+# split a long text into overlapping token windows and run them through the text model as one batch
+# returns the probabilities and token count of each window, and the span of the text each window covers
+def classify_text_chunks(text, models=None):
+    text_tokenizer, text_model = models or model_registry.get('text')
+    max_length = min(TEXT_CHUNK_TOKENS, text_tokenizer.model_max_length)
+    stride = max(0, min(TEXT_CHUNK_STRIDE, max_length // 2)) # the overlap has to leave room for new tokens in each window
+
+    with time_stage('text', 'preprocess'):
+        encodings = text_tokenizer(
+            text, truncation=True, max_length=max_length, stride=stride,
+            return_overflowing_tokens=True, return_offsets_mapping=True, padding=True, return_tensors="pt"
+        )
+        offsets = encodings.pop('offset_mapping').tolist()
+        encodings.pop('overflow_to_sample_mapping', None)
+        lengths = encodings['attention_mask'].sum(dim=1)
+
+    rows = []
+    with torch.no_grad(), time_stage('text', 'forward'):
+        for start in range(0, len(lengths), max(1, TEXT_BUCKET_SIZE)):
+            inputs = {key: value[start:start + TEXT_BUCKET_SIZE] for key, value in encodings.items()}
+            outputs = text_model(**cast_inputs(inputs, text_model))
+            rows.append(torch.nn.functional.softmax(outputs.logits.float(), dim=1))
+
+    spans = []
+    for chunk_offsets in offsets:
+        characters = [(begin, end) for begin, end in chunk_offsets if end > begin] # special and padding tokens have empty offsets
+        spans.append((characters[0][0], characters[-1][1]) if characters else (0, 0))
+
+    return torch.cat(rows), lengths, spans
+
+# score a long text from all of its windows, weighting each window's probabilities by its number of tokens
+def detect_long_text_emotion(text, cache_key, return_chunks, text_model):
+    result = result_caches['text'].get(cache_key)
+    if result is None:
+        probabilities, lengths, spans = inference_executors['text'].run(classify_text_chunks, text)
+        with time_stage('text', 'postprocess'):
+            weights = lengths.float()
+            aggregate = (probabilities * weights[:, None]).sum(dim=0) / weights.sum()
+            id2label = text_model.config.id2label
+            result = {
+                'predictions': probabilities_to_predictions(aggregate, id2label),
+                'chunks': [
+                    {'start_char': begin, 'end_char': end, 'tokens': int(length), 'predictions': probabilities_to_predictions(row, id2label)}
+                    for (begin, end), length, row in zip(spans, lengths, probabilities)
+                ]
+            }
+        result_caches['text'].set(cache_key, result)
+
+    response = {'predictions': result['predictions'], 'chunk_count': len(result['chunks'])}
+    if return_chunks:
+        response['chunks'] = result['chunks']
+    return jsonify(response)
+
+# run the face model on an rgb image, returning the probability of each emotion
+def classify_image(image, processor, model):
+    with time_stage('face', 'preprocess'):
+        inputs = processor(images=image, return_tensors="pt") # process the image
+
+    # get the predictions from the model
+    with torch.no_grad(), time_stage('face', 'forward'):
+        outputs = model(**cast_inputs(inputs, model))
+        return torch.nn.functional.softmax(outputs.logits.float(), dim=1)[0]
+
+# run the face model on a batch of rgb images, returning the probabilities for each image
+def classify_images(images, processor, model):
+    with time_stage('face', 'preprocess'):
+        inputs = processor(images=images, return_tensors="pt")
+
+    with torch.no_grad(), time_stage('face', 'forward'):
+        outputs = model(**cast_inputs(inputs, model))
+        return list(torch.nn.functional.softmax(outputs.logits.float(), dim=1))
+
+# the shortest clip the audio model's convolutional feature encoder can turn into at least one frame
+# models without a convolutional encoder are given one second, as before
+def min_audio_samples(audio_model, rate=AUDIO_SAMPLE_RATE):
+    kernels = getattr(audio_model.config, 'conv_kernel', None)
+    strides = getattr(audio_model.config, 'conv_stride', None)
+    if not kernels or not strides:
+        return rate
+
+    samples = 1
+    for kernel, stride in zip(reversed(kernels), reversed(strides)):
+        samples = (samples - 1) * stride + kernel
+    return samples
+
+# trim the silence from a clip and cap its length, so the model only runs on the audio with sound in it
+# clips shorter than the model can handle are padded to the minimum length, returns the audio and the seconds of sound analysed
+def prepare_audio_for_analysis(audio, audio_model, rate=AUDIO_SAMPLE_RATE):
+    audio = trim_to_voiced(audio, rate, top_db=AUDIO_VAD_TOP_DB, max_seconds=AUDIO_MAX_ANALYSED_SECONDS)
+    analysed_seconds = len(audio) / rate
+    minimum = min_audio_samples(audio_model, rate)
+    if 0 < len(audio) < minimum:
+        audio = np.pad(audio, (0, minimum - len(audio)))
+    return audio, analysed_seconds
+
+# run the audio model on a mono clip, returning the probability of each emotion
+def classify_audio(audio, rate, audio_extractor, audio_model):
+    with time_stage('audio', 'preprocess'):
+        inputs = audio_extractor(audio, sampling_rate=rate, return_tensors="pt") # process the audio
+
+    # get the predictions from the model
+    with torch.no_grad(), time_stage('audio', 'forward'):
+        outputs = audio_model(**cast_inputs(inputs, audio_model))
+        return torch.nn.functional.softmax(outputs.logits.float(), dim=-1)[0]
+
+# run the audio model on a batch of windows, returning the probabilities for each window
+def classify_audio_windows(windows, audio_extractor, audio_model, rate=AUDIO_SAMPLE_RATE):
+    with time_stage('audio', 'preprocess'):
+        inputs = audio_extractor(windows, sampling_rate=rate, return_tensors="pt", padding=True)
+
+    with torch.no_grad(), time_stage('audio', 'forward'):
+        outputs = audio_model(**cast_inputs(inputs, audio_model))
+        return list(torch.nn.functional.softmax(outputs.logits.float(), dim=-1))
+
+# split a stream of audio blocks into overlapping windows, yielding the start sample and the audio of each window
+# the final window is shorter when the clip does not divide evenly, so the end of the clip is always analysed
+def iter_audio_windows(blocks, window_size, hop_size):
+    buffer = np.zeros(0, dtype=np.float32)
+    buffer_start = 0
+    emitted = False
+
+    for block in blocks:
+        buffer = np.concatenate([buffer, block])
+        while len(buffer) >= window_size:
+            yield buffer_start, buffer[:window_size].copy()
+            emitted = True
+            buffer = buffer[hop_size:]
+            buffer_start += hop_size
+
+    # the samples not covered by a previous window
+    if not emitted and len(buffer):
+        yield buffer_start, buffer
+    elif emitted and len(buffer) > window_size - hop_size:
+        yield buffer_start, buffer
+
+# turn a row of probabilities into a list of emotions, sorted by probability in descending order
+def probabilities_to_predictions(probabilities, id2label):
+    predictions = [
+        {'emotion': id2label[i], 'probability': float(prob)}
+        for i, prob in enumerate(probabilities)
+        if i in id2label
+    ]
+    return sorted(predictions, key=lambda x: x['probability'], reverse=True)
+
+# each modality runs its forward passes on its own bounded executor, so one busy model cannot starve the others
+inference_executors = {
+    'face': InferenceExecutor('face', workers=FACE_INFERENCE_WORKERS, max_queue=FACE_INFERENCE_QUEUE),
+    'text': InferenceExecutor('text', workers=TEXT_INFERENCE_WORKERS, max_queue=TEXT_INFERENCE_QUEUE),
+    'audio': InferenceExecutor('audio', workers=AUDIO_INFERENCE_WORKERS, max_queue=AUDIO_INFERENCE_QUEUE)
+}
+
+# concurrent text requests are queued here and share a forward pass on the text executor
+text_batcher = MicroBatcher(
+    lambda texts: inference_executors['text'].run(classify_text_batch, texts),
+    max_batch_size=TEXT_BATCH_MAX_SIZE,
+    max_wait_ms=TEXT_BATCH_MAX_WAIT_MS,
+    name="text-emotion",
+    max_queue=TEXT_INFERENCE_QUEUE
+)
+
+# the response when an inference queue is full, telling the client when to try again
+def queue_full_response(error):
+    response = jsonify({'error': str(error), 'retry_after': error.retry_after})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
 # detect the emotion from an image
 def detect_emotion():
     try:
@@ -101,77 +488,81 @@ def detect_emotion():
         
         try:
             if 'image' in request.files:
-                file = request.files['image']
-                image = Image.open(file.stream)
+                image_stream = io.BytesIO(request.files['image'].read())
             else:
-                base64_data = request.json['image']
-                if ',' in base64_data:
-                    base64_data = base64_data.split(',', 1)[1]
-                
-                img_data = base64.b64decode(base64_data)
-                image = Image.open(io.BytesIO(img_data))
-
-            if image.mode == 'RGBA':
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                background.paste(image, mask=image.split()[3])
-                image = background
-            elif image.mode != 'RGB':
-                image = image.convert('RGB')
+                image_stream = decode_base64_to_stream(request.json['image'])
+
+            # the same image bytes always give the same predictions, so return them from the cache if present
+            cache_key = make_cache_key(model_revision('face'), image_stream.getbuffer())
+            cached_predictions = result_caches['face'].get(cache_key)
+            if cached_predictions is not None:
+                return jsonify({'predictions': cached_predictions})
         
         except Exception as img_error:
             return jsonify({'error': f'Error during image processing: {str(img_error)}'}), 400
 
         try:
-            inputs = processor(images=image, return_tensors="pt") # process the image
-            
-            # get the predictions from the model
-            with torch.no_grad():
-                outputs = model(**inputs)
-                logits = outputs.logits
-                probabilities = torch.nn.functional.softmax(logits, dim=1)[0]
-            
-            # get the probabilities for each emotion
-            prob_values = {}
-            for i, prob in enumerate(probabilities):
-                if i in model.config.id2label:
-                    prob_values[model.config.id2label[i]] = float(prob)
-                else:
-                    raise
+            processor, model = model_registry.get('face')
+        except Exception as load_error:
+            return model_unavailable_response('face', load_error)
+
+        try:
+            # decode close to the processor's input size rather than at full resolution
+            with time_stage('face', 'decode'):
+                image = open_downscaled_image(image_stream, processor_target_size(processor), MAX_IMAGE_PIXELS)
+        except ImageTooLargeError as size_error:
+            return jsonify({'error': str(size_error)}), 413
+        except Exception as img_error:
+            return jsonify({'error': f'Error during image processing: {str(img_error)}'}), 400
+
+        try:
+            probabilities = inference_executors['face'].run(classify_image, image, processor, model)
+            with time_stage('face', 'postprocess'):
+                # get the probabilities for each emotion
+                prob_values = {}
+                for i, prob in enumerate(probabilities):
+                    if i in model.config.id2label:
+                        prob_values[model.config.id2label[i]] = float(prob)
+                    else:
+                        raise
             
-            predictions = []
+                predictions = []
             
-            try:
-                sorted_indices = torch.argsort(probabilities, descending=True)
+                try:
+                    sorted_indices = torch.argsort(probabilities, descending=True)
                 
-                # iterate through the sorted indices to get the emotions and their probabilities
-                for idx in sorted_indices:
-                    idx_item = idx.item()
-                    if idx_item in model.config.id2label:
-                        emotion_name = model.config.id2label[idx_item]
-                        prob = float(probabilities[idx_item])
-                        predictions.append({
-                            'emotion': emotion_name,
-                            'probability': prob
-                        })
-                    else:
-                        raise
+                    # iterate through the sorted indices to get the emotions and their probabilities
+                    for idx in sorted_indices:
+                        idx_item = idx.item()
+                        if idx_item in model.config.id2label:
+                            emotion_name = model.config.id2label[idx_item]
+                            prob = float(probabilities[idx_item])
+                            predictions.append({
+                                'emotion': emotion_name,
+                                'probability': prob
+                            })
+                        else:
+                            raise
                 
-                # sort the predictions by probability in descending order
-                predictions = sorted(predictions, key=lambda x: x['probability'], reverse=True)
+                    # sort the predictions by probability in descending order
+                    predictions = sorted(predictions, key=lambda x: x['probability'], reverse=True)
                 
-                if not predictions:
-                    return jsonify({'error': 'No emotions detected in this image'}), 200
+                    if not predictions:
+                        return jsonify({'error': 'No emotions detected in this image'}), 200
                 
-                return jsonify({'predictions': predictions})
+                    result_caches['face'].set(cache_key, predictions)
+                    return jsonify({'predictions': predictions})
                 
-            except Exception as process_error:
-                return jsonify({
-                    'predictions': [
-                        {'emotion': 'unknown', 'probability': 1.0}
-                    ],
-                    'warning': f'Error in prediction processing: {str(process_error)}'
-                })
+                except Exception as process_error:
+                    return jsonify({
+                        'predictions': [
+                            {'emotion': 'unknown', 'probability': 1.0}
+                        ],
+                        'warning': f'Error in prediction processing: {str(process_error)}'
+                    })
             
+        except InferenceQueueFull as queue_error:
+            return queue_full_response(queue_error)
         except Exception as predict_error:
             return jsonify({'error': f'Error analysing image: {str(predict_error)}'}), 500
         
@@ -187,190 +578,736 @@ def detect_text_emotion():
             return jsonify({'error': 'No text provided'}), 400
         
         text = request.json['text']
+        if not isinstance(text, str):
+            return jsonify({'error': 'Text must be a string'}), 400
+
+        text = normalise_text(text)
+
+        # chunked mode scores the whole of a long text rather than only its first 512 tokens
+        if request.json.get('chunked'):
+            try:
+                text_tokenizer, text_model = model_registry.get('text')
+            except Exception as load_error:
+                return model_unavailable_response('text', load_error)
+
+            try:
+                cache_key = make_cache_key(model_revision('text'), 'chunked', text)
+                return detect_long_text_emotion(text, cache_key, bool(request.json.get('return_chunks')), text_model)
+            except InferenceQueueFull as queue_error:
+                return queue_full_response(queue_error)
+            except Exception as predict_error:
+                return jsonify({'error': f'Error analysing text: {str(predict_error)}'}), 500
+
+        cache_key = make_cache_key(model_revision('text'), text)
+        cached_predictions = result_caches['text'].get(cache_key)
+        if cached_predictions is not None:
+            return jsonify({'predictions': cached_predictions})
+
+        try:
+            text_tokenizer, text_model = model_registry.get('text')
+        except Exception as load_error:
+            return model_unavailable_response('text', load_error)
         
         try:
-            inputs = text_tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
-            
-            with torch.no_grad():
-                outputs = text_model(**inputs)
-                logits = outputs.logits
-                probabilities = torch.nn.functional.softmax(logits, dim=1)[0]
-            
-            prob_values = {}
-            for i, prob in enumerate(probabilities):
-                if i in text_model.config.id2label:
-                    prob_values[text_model.config.id2label[i]] = float(prob)
-                else:
-                    pass
+            probabilities = text_batcher.submit(text).result() # wait for this text's row of the batched prediction
+            with time_stage('text', 'postprocess'):
+                prob_values = {}
+                for i, prob in enumerate(probabilities):
+                    if i in text_model.config.id2label:
+                        prob_values[text_model.config.id2label[i]] = float(prob)
+                    else:
+                        pass
             
-            predictions = []
+                predictions = []
             
-            try:
-                sorted_indices = torch.argsort(probabilities, descending=True)
+                try:
+                    sorted_indices = torch.argsort(probabilities, descending=True)
                 
-                # iterate through the sorted indices to get the emotions and their probabilities
-                for idx in sorted_indices:
-                    idx_item = idx.item()
-                    if idx_item in text_model.config.id2label:
-                        emotion_name = text_model.config.id2label[idx_item]
-                        prob = float(probabilities[idx_item])
-                        predictions.append({
-                            'emotion': emotion_name,
-                            'probability': prob
-                        })
-                    else:
-                        print(f"Warning: [{request_id}] Label key {idx_item} not found in id2label mapping")
+                    # iterate through the sorted indices to get the emotions and their probabilities
+                    for idx in sorted_indices:
+                        idx_item = idx.item()
+                        if idx_item in text_model.config.id2label:
+                            emotion_name = text_model.config.id2label[idx_item]
+                            prob = float(probabilities[idx_item])
+                            predictions.append({
+                                'emotion': emotion_name,
+                                'probability': prob
+                            })
+                        else:
+                            print(f"Warning: [{request_id}] Label key {idx_item} not found in id2label mapping")
                 
-                # sort the predictions by probability in descending order
-                predictions = sorted(predictions, key=lambda x: x['probability'], reverse=True)
+                    # sort the predictions by probability in descending order
+                    predictions = sorted(predictions, key=lambda x: x['probability'], reverse=True)
                 
-                if not predictions:
-                    return jsonify({'error': 'No emotions detected in this text'}), 200
+                    if not predictions:
+                        return jsonify({'error': 'No emotions detected in this text'}), 200
                 
-                return jsonify({'predictions': predictions})
+                    result_caches['text'].set(cache_key, predictions)
+                    return jsonify({'predictions': predictions})
                 
-            except Exception as process_error:
-                return jsonify({
-                    'predictions': [
-                        {'emotion': 'unknown', 'probability': 1.0}
-                    ],
-                    'warning': f'Error in prediction processing: {str(process_error)}'
-                })
+                except Exception as process_error:
+                    return jsonify({
+                        'predictions': [
+                            {'emotion': 'unknown', 'probability': 1.0}
+                        ],
+                        'warning': f'Error in prediction processing: {str(process_error)}'
+                    })
             
+        except InferenceQueueFull as queue_error:
+            return queue_full_response(queue_error)
         except Exception as predict_error:
             return jsonify({'error': f'Error analysing text: {str(predict_error)}'}), 500
         
     except Exception as e:
         return jsonify({'error': f'Detection failed: {str(e)}'}), 500
 
+# read the texts for the bulk endpoint, either a json body with a list of texts or newline-delimited json
+def read_bulk_texts():
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl', 'application/jsonlines'):
+        texts = []
+        for line_number, line in enumerate(request.get_data(as_text=True).splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                raise ValueError(f'Line {line_number} is not valid JSON')
+            texts.append(item.get('text') if isinstance(item, dict) else item)
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or 'texts' not in data:
+            raise ValueError('No texts provided')
+        texts = data['texts']
+        if not isinstance(texts, list):
+            raise ValueError('Texts must be a list')
+
+    for i, text in enumerate(texts):
+        if not isinstance(text, str):
+            raise ValueError(f'Text at position {i} must be a string')
+    return texts
+
+# detect the emotions for many texts in one request, the results are returned in the same order as the texts
+def detect_text_emotion_bulk():
+    try:
+        try:
+            texts = read_bulk_texts()
+        except ValueError as input_error:
+            return jsonify({'error': str(input_error)}), 400
+
+        if not texts:
+            return jsonify({'error': 'No texts provided'}), 400
+        if len(texts) > TEXT_BULK_MAX_ITEMS:
+            return jsonify({'error': f'Too many texts, the maximum is {TEXT_BULK_MAX_ITEMS} per request'}), 400
+
+        # take what we can from the cache, only the remaining texts go through the model
+        revision = model_revision('text')
+        texts = [normalise_text(text) for text in texts]
+        cache_keys = [make_cache_key(revision, text) for text in texts]
+        results = [None] * len(texts)
+        for i, cache_key in enumerate(cache_keys):
+            cached_predictions = result_caches['text'].get(cache_key)
+            if cached_predictions is not None:
+                results[i] = {'predictions': cached_predictions}
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return jsonify({'results': results})
+
+        try:
+            text_tokenizer, text_model = model_registry.get('text')
+        except Exception as load_error:
+            return model_unavailable_response('text', load_error)
+
+        try:
+            probabilities = inference_executors['text'].run(
+                classify_text_batch, [texts[i] for i in missing], models=(text_tokenizer, text_model)
+            )
+            id2label = text_model.config.id2label
+            with time_stage('text', 'postprocess'):
+                for i, row in zip(missing, probabilities):
+                    predictions = probabilities_to_predictions(row, id2label)
+                    result_caches['text'].set(cache_keys[i], predictions)
+                    results[i] = {'predictions': predictions}
+
+            return jsonify({'results': results})
+
+        except InferenceQueueFull as queue_error:
+            return queue_full_response(queue_error)
+        except Exception as predict_error:
+            return jsonify({'error': f'Error analysing texts: {str(predict_error)}'}), 500
+
+    except Exception as e:
+        return jsonify({'error': f'Detection failed: {str(e)}'}), 500
+
 def detect_audio_emotion():
     try:
         # generate a unique request identifier by encoding random bytes in base64
         request_id = base64.b64encode(os.urandom(6)).decode('ascii')
-
-        if audio_model is None or audio_extractor is None:
-            return jsonify({
-                'error': 'Audio emotion detection model not loaded',
-                'details': 'Run python download_models.py to download all required models.'
-            }), 503
         
         if 'audio' not in request.files and 'audio' not in request.json:
             return jsonify({'error': 'No audio provided'}), 400
         
-        # create a temporary directory for audio files, for processing only
-        temp_dir = os.path.join("debug", "audio_temp")
-        os.makedirs(temp_dir, exist_ok=True)
-        
         try:
-            audio_path = None
-            
             if 'audio' in request.files:
-                file = request.files['audio']
-                file_ext = os.path.splitext(file.filename)[1].lower()
-                
-                audio_path = os.path.join(temp_dir, f"audio_{request_id}_{secure_filename(file.filename)}")
-                file.save(audio_path)
-                
-                if file_ext == '.webm':
-                    try:
-                        wav_path = os.path.join(temp_dir, f"audio_{request_id}_converted.wav")
-                        
-                        if os.path.exists(wav_path) and os.path.getsize(wav_path) > 0:
-                            audio_path = wav_path
-                    except Exception as conv_error:
-                        print(f"[{request_id}] Could not convert WebM using ffmpeg: {str(conv_error)}")
-                
-            elif 'audio' in request.json:
+                audio_data = request.files['audio'].read()
+            else:
                 base64_data = request.json['audio']
                 if ',' in base64_data:
                     base64_data = base64_data.split(',', 1)[1]
                 
                 audio_data = base64.b64decode(base64_data)
-                
-                audio_path = os.path.join(temp_dir, f"audio_{request_id}.wav")
-                with open(audio_path, "wb") as f:
-                    f.write(audio_data) # write the audio data to the file
-            
-            try:
-                audio, rate = librosa.load(audio_path, sr=16000, mono=True) # load the audio file with the correct sample rate and mono
-            except Exception as load_error:
-                try:
-                    audio, rate = librosa.load(audio_path, sr=16000, mono=True, offset=0.0, duration=5.0)
-                except Exception as fallback_error:
-                    try:
-                        audio_data, samplerate = sf.read(audio_path) # use soundfile if the initial load fails
-                        audio = audio_data.mean(axis=1) if len(audio_data.shape) > 1 else audio_data
-                        rate = samplerate
-                        if rate != 16000: # if the sample rate is not 16000, resample the audio
-                            audio = librosa.resample(audio, orig_sr=rate, target_sr=16000)
-                            rate = 16000
-
-                    except Exception as last_error:
-                        raise Exception(f"Failed to load audio file after multiple attempts. Initial error: {str(load_error)}. Fallback error: {str(fallback_error)}. Final attempt error: {str(last_error)}. Try a different audio format.")
+
+            # the same audio bytes always give the same predictions, so return them from the cache if present
+            cache_key = make_cache_key(model_revision('audio'), audio_data)
+            cached_result = result_caches['audio'].get(cache_key)
+            if cached_result is not None:
+                return jsonify(cached_result)
             
-            # if the audio is too short, pad it to ensure valid analysis
-            if len(audio) < rate:
-                print(f"[{request_id}] Audio too short ({len(audio)/rate:.2f}s), padding to ensure valid analysis")
-                padding = np.zeros(rate - len(audio))
-                audio = np.concatenate([audio, padding])
+            # decode once in memory, mixed down to mono at the model's sample rate
+            rate = AUDIO_SAMPLE_RATE
+            with time_stage('audio', 'decode'):
+                audio = decode_audio(audio_data, rate)
+            original_seconds = len(audio) / rate
                 
         except Exception as audio_error:
             print(f"[{request_id}] Error processing audio: {str(audio_error)}")
             print(traceback.format_exc())
-            
-            if audio_path and os.path.exists(audio_path):
-                try:
-                    os.remove(audio_path)
-                except:
-                    pass
                 
             return jsonify({
                 'error': f'Audio file cannot be processed: {str(audio_error)}',
                 'details': 'Try using a different file format like WAV or MP3, or ensure the audio file is not corrupted.'
             }), 400
+
+        try:
+            audio_extractor, audio_model = model_registry.get('audio')
+        except Exception as load_error:
+            return model_unavailable_response('audio', load_error)
+
+        # only the parts of the clip with sound in them are analysed
+        audio, analysed_seconds = prepare_audio_for_analysis(audio, audio_model, rate)
+        durations = {'analysed_seconds': round(analysed_seconds, 3), 'original_seconds': round(original_seconds, 3)}
+        if not len(audio):
+            print(f"[{request_id}] No sound found in {original_seconds:.2f}s of audio")
+            return jsonify({'error': 'No speech or sound detected in this audio', **durations}), 200
         
         try:
-            inputs = audio_extractor(audio, sampling_rate=rate, return_tensors="pt") # process the audio
-            
-            # get the predictions from the model
-            with torch.no_grad():
-                outputs = audio_model(**inputs)
-                logits = outputs.logits
-                probabilities = torch.nn.functional.softmax(logits, dim=-1)[0]
-            
-            predictions = []
-            
-            # iterate through the sorted indices to get the emotions and their probabilities
-            for idx, prob in enumerate(probabilities):
-                if idx in audio_model.config.id2label:
-                    emotion_name = audio_model.config.id2label[idx]
-                    predictions.append({
-                        'emotion': emotion_name,
-                        'probability': float(prob)
-                    })
+            probabilities = inference_executors['audio'].run(classify_audio, audio, rate, audio_extractor, audio_model)
+            with time_stage('audio', 'postprocess'):
+                predictions = []
             
-            # sort the predictions by probability in descending order
-            predictions = sorted(predictions, key=lambda x: x['probability'], reverse=True)
+                # iterate through the sorted indices to get the emotions and their probabilities
+                for idx, prob in enumerate(probabilities):
+                    if idx in audio_model.config.id2label:
+                        emotion_name = audio_model.config.id2label[idx]
+                        predictions.append({
+                            'emotion': emotion_name,
+                            'probability': float(prob)
+                        })
             
-            if audio_path and os.path.exists(audio_path):
-                os.remove(audio_path)
+                # sort the predictions by probability in descending order
+                predictions = sorted(predictions, key=lambda x: x['probability'], reverse=True)
             
-            if not predictions:
-                return jsonify({'error': 'No emotions detected in this audio'}), 200
+                if not predictions:
+                    return jsonify({'error': 'No emotions detected in this audio'}), 200
             
-            return jsonify({'predictions': predictions})
+                result = {'predictions': predictions, **durations}
+                result_caches['audio'].set(cache_key, result)
+                return jsonify(result)
             
+        except InferenceQueueFull as queue_error:
+            return queue_full_response(queue_error)
         except Exception as predict_error:
-            if audio_path and os.path.exists(audio_path):
-                os.remove(audio_path)
-                
             return jsonify({'error': f'Error analysing audio: {str(predict_error)}'}), 500
         
     except Exception as e:
         return jsonify({'error': f'Detection failed: {str(e)}'}), 500
 
+# detect the emotions over time in a long audio clip
+# the response is streamed as newline-delimited json, one line per window followed by a line with the aggregate for the whole clip
+def detect_audio_emotion_timeline():
+    try:
+        try:
+            audio_extractor, audio_model = model_registry.get('audio')
+        except Exception as load_error:
+            return model_unavailable_response('audio', load_error)
+
+        if 'audio' in request.files:
+            source = request.files['audio'].stream
+        elif request.is_json and 'audio' in request.json:
+            base64_data = request.json['audio']
+            if ',' in base64_data:
+                base64_data = base64_data.split(',', 1)[1]
+            source = io.BytesIO(base64.b64decode(base64_data))
+        else:
+            return jsonify({'error': 'No audio provided'}), 400
+
+        # open the file before streaming starts, so unreadable audio still gets a normal error response
+        try:
+            blocks = open_audio_blocks(source, AUDIO_SAMPLE_RATE, AUDIO_DECODE_BLOCK_SECONDS)
+        except Exception as audio_error:
+            return jsonify({
+                'error': f'Audio file cannot be processed: {str(audio_error)}',
+                'details': 'Try using a different file format like WAV or MP3, or ensure the audio file is not corrupted.'
+            }), 400
+
+        rate = AUDIO_SAMPLE_RATE
+        window_size = int(AUDIO_WINDOW_SECONDS * rate)
+        hop_size = max(1, min(window_size, int(AUDIO_WINDOW_HOP_SECONDS * rate)))
+        id2label = audio_model.config.id2label
+
+        def generate():
+            totals = None
+            total_weight = 0.0
+            segments = 0
+            end_sample = 0
+            batch = []
+
+            # classify the queued windows and yield one line per window
+            def flush():
+                nonlocal totals, total_weight, segments
+                # very short windows are padded to one second, as with the single clip endpoint
+                padded = [np.pad(w, (0, rate - len(w))) if len(w) < rate else w for _, w in batch]
+                rows = inference_executors['audio'].run(classify_audio_windows, padded, audio_extractor, audio_model, rate)
+                for (start, window), row in zip(batch, rows):
+                    weight = len(window) / rate
+                    totals = row * weight if totals is None else totals + row * weight
+                    total_weight += weight
+                    segments += 1
+                    yield json.dumps({
+                        'start': round(start / rate, 3),
+                        'end': round((start + len(window)) / rate, 3),
+                        'predictions': probabilities_to_predictions(row, id2label)
+                    }) + '\n'
+                batch.clear()
+
+            try:
+                for start, window in iter_audio_windows(blocks, window_size, hop_size):
+                    batch.append((start, window))
+                    end_sample = start + len(window)
+                    if len(batch) >= AUDIO_WINDOW_BATCH_SIZE:
+                        yield from flush()
+                if batch:
+                    yield from flush()
+
+                if totals is None:
+                    yield json.dumps({'error': 'No audio found in this file'}) + '\n'
+                    return
+
+                # the aggregate is the average of the window probabilities, weighted by the length of each window
+                yield json.dumps({
+                    'aggregate': probabilities_to_predictions(totals / total_weight, id2label),
+                    'duration': round(end_sample / rate, 3),
+                    'segments': segments
+                }) + '\n'
+
+            except InferenceQueueFull as queue_error:
+                # the headers have already been sent, so the client is told to retry in the stream instead
+                yield json.dumps({'error': str(queue_error), 'retry_after': queue_error.retry_after}) + '\n'
+            except Exception as predict_error:
+                print(f"Error analysing audio timeline: {str(predict_error)}")
+                traceback.print_exc()
+                yield json.dumps({'error': f'Error analysing audio: {str(predict_error)}'}) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    except Exception as e:
+        return jsonify({'error': f'Detection failed: {str(e)}'}), 500
+
+# detect the emotions over time in a video
+# frames are sampled with ffmpeg, frames that look the same as the last analysed one are skipped,
+# and the rest go through the face model in batches, each analysed frame covers the time until the next one
+def detect_video_emotion():
+    try:
+        if 'video' not in request.files:
+            return jsonify({'error': 'No video provided'}), 400
+
+        try:
+            fps = float(request.form.get('fps', VIDEO_SAMPLE_FPS))
+        except ValueError:
+            return jsonify({'error': 'fps must be a number'}), 400
+        if not 0 < fps <= VIDEO_MAX_SAMPLE_FPS:
+            return jsonify({'error': f'fps must be greater than 0 and at most {VIDEO_MAX_SAMPLE_FPS}'}), 400
+
+        try:
+            processor, model = model_registry.get('face')
+        except Exception as load_error:
+            return model_unavailable_response('face', load_error)
+
+        id2label = model.config.id2label
+        width, height = processor_target_size(processor)
+
+        # ffmpeg needs a file it can seek in, as mp4 files often keep their index at the end
+        with tempfile.TemporaryDirectory() as temp_dir:
+            video_path = os.path.join(temp_dir, 'upload')
+            request.files['video'].save(video_path)
+
+            sampled = {'frames': 0, 'last_timestamp': 0.0}
+
+            def count_sampled(frames):
+                for timestamp, frame in frames:
+                    sampled['frames'] += 1
+                    sampled['last_timestamp'] = timestamp
+                    yield timestamp, frame
+
+            frames = iter_video_frames(video_path, fps, width, height, max_frames=VIDEO_MAX_FRAMES,
+                                      timeout=VIDEO_DECODE_TIMEOUT_SECONDS)
+            distinct_frames = iter_distinct_frames(count_sampled(frames), VIDEO_FRAME_DIFF_THRESHOLD)
+
+            timeline = []
+            batch = []
+
+            def flush():
+                rows = inference_executors['face'].run(classify_images, [frame for _, frame in batch], processor, model)
+                for (timestamp, _), row in zip(batch, rows):
+                    timeline.append({'start': timestamp, 'probabilities': row})
+                batch.clear()
+
+            try:
+                for timestamp, frame in distinct_frames:
+                    batch.append((timestamp, frame))
+                    if len(batch) >= VIDEO_BATCH_SIZE:
+                        flush()
+            except VideoDecodeError as video_error:
+                return jsonify({'error': f'Video file cannot be processed: {str(video_error)}'}), 400
+            except InferenceQueueFull as queue_error:
+                return queue_full_response(queue_error)
+            except Exception as predict_error:
+                return jsonify({'error': f'Error analysing video: {str(predict_error)}'}), 500
+            finally:
+                frames.close() # stops ffmpeg if we return early
+
+            try:
+                if batch:
+                    flush()
+            except InferenceQueueFull as queue_error:
+                return queue_full_response(queue_error)
+            except Exception as predict_error:
+                return jsonify({'error': f'Error analysing video: {str(predict_error)}'}), 500
+
+        # each analysed frame lasts until the next one, the last until the end of the final sampled frame
+        duration = sampled['last_timestamp'] + 1 / fps
+        totals = None
+        for i, segment in enumerate(timeline):
+            end = timeline[i + 1]['start'] if i + 1 < len(timeline) else duration
+            weight = end - segment['start']
+            probabilities = segment.pop('probabilities')
+            totals = probabilities * weight if totals is None else totals + probabilities * weight
+            segment['start'] = round(segment['start'], 3)
+            segment['end'] = round(end, 3)
+            segment['predictions'] = probabilities_to_predictions(probabilities, id2label)
+
+        return jsonify({
+            'timeline': timeline,
+            'aggregate': probabilities_to_predictions(totals / duration, id2label),
+            'duration': round(duration, 3),
+            'fps': fps,
+            'frames_sampled': sampled['frames'],
+            'frames_analysed': len(timeline),
+            'truncated': sampled['frames'] >= VIDEO_MAX_FRAMES
+        })
+
+    except Exception as e:
+        return jsonify({'error': f'Detection failed: {str(e)}'}), 500
+
+# map a model's label onto the shared set of emotion names
+def canonical_emotion(label):
+    label = label.lower()
+    return EMOTION_LABEL_ALIASES.get(label, label)
+
+# return a future that resolves with fn applied to the result of another future
+def chain_future(future, fn):
+    chained = Future()
+
+    def done(source):
+        try:
+            chained.set_result(fn(source.result()))
+        except Exception as e:
+            chained.set_exception(e)
+
+    future.add_done_callback(done)
+    return chained
+
+# a future that has already resolved, for predictions taken from the cache
+def resolved_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+# decode and classify an image, run on the face executor
+def predict_face(image_stream, processor, model):
+    with time_stage('face', 'decode'):
+        image = open_downscaled_image(image_stream, processor_target_size(processor), MAX_IMAGE_PIXELS)
+    probabilities = classify_image(image, processor, model)
+    with time_stage('face', 'postprocess'):
+        return probabilities_to_predictions(probabilities, model.config.id2label)
+
+# decode, trim and classify an audio clip, run on the audio executor
+# the result also reports how much of the clip was analysed, as with the single clip endpoint
+def predict_audio(audio_data, audio_extractor, audio_model):
+    rate = AUDIO_SAMPLE_RATE
+    with time_stage('audio', 'decode'):
+        audio = decode_audio(audio_data, rate)
+    original_seconds = len(audio) / rate
+    audio, analysed_seconds = prepare_audio_for_analysis(audio, audio_model, rate)
+    if not len(audio):
+        raise ValueError('No speech or sound detected in this audio')
+
+    probabilities = classify_audio(audio, rate, audio_extractor, audio_model)
+    with time_stage('audio', 'postprocess'):
+        return {
+            'predictions': probabilities_to_predictions(probabilities, audio_model.config.id2label),
+            'analysed_seconds': round(analysed_seconds, 3),
+            'original_seconds': round(original_seconds, 3)
+        }
+
+# start the prediction for one modality without waiting for it, returning a future of its result ({'predictions': [...]})
+# the cache keys are the same as the single modality endpoints, so the two share cached predictions
+def submit_prediction(modality, data):
+    if modality == 'text':
+        data = normalise_text(data)
+        cache_key = make_cache_key(model_revision('text'), data)
+    else:
+        cache_key = make_cache_key(model_revision(modality), data)
+
+    cached = result_caches[modality].get(cache_key)
+    if cached is not None:
+        return resolved_future(as_modality_result(modality, cached))
+
+    processor, model = model_registry.get(modality)
+    if modality == 'face':
+        future = inference_executors['face'].submit(predict_face, io.BytesIO(data), processor, model)
+    elif modality == 'text':
+        future = chain_future(
+            text_batcher.submit(data),
+            lambda probabilities: text_predictions(probabilities, model.config.id2label)
+        )
+    else:
+        future = inference_executors['audio'].submit(predict_audio, data, processor, model)
+
+    def cache(value):
+        result_caches[modality].set(cache_key, value)
+        return as_modality_result(modality, value)
+
+    return chain_future(future, cache)
+
+# the audio cache holds the whole result (with the analysed duration), the face and text caches hold only the predictions
+def as_modality_result(modality, value):
+    return value if modality == 'audio' else {'predictions': value}
+
+# turn a row of text probabilities into predictions, timed as the text postprocessing stage
+def text_predictions(probabilities, id2label):
+    with time_stage('text', 'postprocess'):
+        return probabilities_to_predictions(probabilities, id2label)
+
+# average the distributions of several modalities over the shared emotion names, using the given weight for each
+def fuse_predictions(predictions_by_modality, weights):
+    totals = {}
+    total_weight = 0.0
+    for modality, predictions in predictions_by_modality.items():
+        weight = weights[modality]
+        total_weight += weight
+        for prediction in predictions:
+            emotion = canonical_emotion(prediction['emotion'])
+            totals[emotion] = totals.get(emotion, 0.0) + weight * prediction['probability']
+
+    if total_weight <= 0:
+        return []
+    fused = [{'emotion': emotion, 'probability': total / total_weight} for emotion, total in totals.items()]
+    return sorted(fused, key=lambda x: x['probability'], reverse=True)
+
+# read the inputs of the multimodal endpoint, either as a multipart form with files or as json with base64 data
+def read_multimodal_inputs():
+    inputs = {}
+    if request.files or request.form:
+        if 'image' in request.files:
+            inputs['face'] = request.files['image'].read()
+        if 'audio' in request.files:
+            inputs['audio'] = request.files['audio'].read()
+        text = request.form.get('text')
+        weights = json.loads(request.form['weights']) if 'weights' in request.form else {}
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            raise ValueError('Provide an image, text or audio as form data or json')
+        if data.get('image'):
+            inputs['face'] = decode_base64_to_stream(data['image']).getvalue()
+        if data.get('audio'):
+            inputs['audio'] = decode_base64_to_stream(data['audio']).getvalue()
+        text = data.get('text')
+        weights = data.get('weights') or {}
+
+    if text is not None:
+        if not isinstance(text, str):
+            raise ValueError('Text must be a string')
+        if text.strip():
+            inputs['text'] = text
+
+    # the weights can be given by modality name, or with image in place of face
+    if not isinstance(weights, dict):
+        raise ValueError('Weights must be an object of modality names to numbers')
+    if 'image' in weights:
+        weights['face'] = weights.pop('image')
+    for name, weight in weights.items():
+        if name not in ('face', 'text', 'audio'):
+            raise ValueError(f'Unknown modality in weights: {name}')
+        if not isinstance(weight, (int, float)) or weight < 0:
+            raise ValueError(f'The weight for {name} must be a number of at least 0')
+
+    return inputs, {modality: float(weights.get(modality, 1.0)) for modality in inputs}
+
+# detect the emotion from an image, a transcript and an audio clip in one request
+# the three models run at the same time, so the request takes about as long as the slowest of them
+def detect_multimodal_emotion():
+    try:
+        try:
+            inputs, weights = read_multimodal_inputs()
+        except ValueError as input_error:
+            return jsonify({'error': str(input_error)}), 400
+
+        if not inputs:
+            return jsonify({'error': 'No image, text or audio provided'}), 400
+
+        # start every modality before waiting for any of them
+        futures = {}
+        results = {}
+        for modality, data in inputs.items():
+            try:
+                futures[modality] = submit_prediction(modality, data)
+            except InferenceQueueFull as queue_error:
+                return queue_full_response(queue_error)
+            except Exception as submit_error:
+                results[modality] = {'error': str(submit_error)}
+
+        for modality, future in futures.items():
+            try:
+                results[modality] = future.result()
+            except InferenceQueueFull as queue_error:
+                return queue_full_response(queue_error)
+            except ImageTooLargeError as size_error:
+                results[modality] = {'error': str(size_error)}
+            except Exception as predict_error:
+                results[modality] = {'error': f'Error analysing {modality}: {str(predict_error)}'}
+
+        # fuse the modalities that succeeded, a failed modality does not fail the whole request
+        succeeded = {modality: result['predictions'] for modality, result in results.items() if 'predictions' in result}
+        if not succeeded:
+            return jsonify({'error': 'No modality could be analysed', 'modalities': results}), 500
+
+        used_weights = {modality: weights[modality] for modality in succeeded}
+        return jsonify({
+            'modalities': results,
+            'fused': {
+                'predictions': fuse_predictions(succeeded, used_weights),
+                'weights': used_weights
+            }
+        })
+
+    except Exception as e:
+        return jsonify({'error': f'Detection failed: {str(e)}'}), 500
+
+# run a synthetic input through every loaded model, on the same executors real requests use
+def warm_up_models():
+    for name in model_registry.loaded():
+        processor, model = model_registry.get(name)
+        if name == 'face':
+            width, height = processor_target_size(processor)
+            image = np.zeros((height, width, 3), dtype=np.uint8)
+            inference_executors['face'].run(classify_image, image, processor, model)
+        elif name == 'text':
+            inference_executors['text'].run(classify_text_batch, ['warm up'], models=(processor, model))
+        else:
+            audio = np.zeros(AUDIO_SAMPLE_RATE, dtype=np.float32)
+            inference_executors['audio'].run(classify_audio, audio, AUDIO_SAMPLE_RATE, processor, model)
+        print(f"Warmed up the {name} model")
+
+# the progress of the warm-up in this process, the pid tells a forked worker that the state was copied from its parent
+warmup_state = {'pid': None, 'finished': False, 'error': None}
+warmup_lock = threading.Lock()
+
+def run_warmup():
+    try:
+        warm_up_models()
+    except Exception as e:
+        print(f"Error warming up the models: {str(e)}")
+        traceback.print_exc()
+        warmup_state['error'] = str(e)
+    finally:
+        warmup_state['finished'] = True
+
+# start the warm-up in the background, once per process
+def start_warmup():
+    if not WARMUP_ON_START:
+        return
+    with warmup_lock:
+        if warmup_state['pid'] == os.getpid():
+            return
+        warmup_state.update(pid=os.getpid(), finished=False, error=None)
+    threading.Thread(target=run_warmup, name="model-warmup", daemon=True).start()
+
+# whether this process has finished warming up, along with the state to report
+def warmup_status():
+    if not WARMUP_ON_START:
+        return True, {'status': 'ready', 'warmup': 'disabled'}
+
+    start_warmup() # in case this process has not started its warm-up yet
+    if not warmup_state['finished']:
+        return False, {'status': 'warming up'}
+    if warmup_state['error']:
+        return False, {'status': 'warm-up failed', 'error': warmup_state['error']}
+    return True, {'status': 'ready', 'models': model_registry.loaded()}
+
+if not WARMUP_AFTER_FORK:
+    start_warmup()
+
+# get the hit and miss counts of the prediction caches
+def emotion_cache_stats():
+    return jsonify({name: cache.stats() for name, cache in result_caches.items()})
+
+# get the queue depth and wait times of the inference executors, for monitoring and autoscaling
+def inference_stats():
+    stats = {
+        name: dict(executor.stats.snapshot(), workers=executor.workers, max_queue=executor.max_queue)
+        for name, executor in inference_executors.items()
+    }
+    stats['text_batcher'] = dict(text_batcher.stats.snapshot(), max_queue=text_batcher.max_queue)
+    stats['torch_threads'] = torch.get_num_threads()
+    return jsonify(stats)
+
+# the cache and queue figures for /metrics, read each time it is rendered
+def emotion_metrics():
+    cache_stats = {name: cache.stats() for name, cache in result_caches.items()}
+    queue_stats = {name: executor.stats.snapshot() for name, executor in inference_executors.items()}
+    queue_stats['text_batcher'] = text_batcher.stats.snapshot()
+
+    lines = []
+    lines += render_samples('emotion_cache_hits_total', 'counter', 'Predictions served from the cache',
+                            [({'modality': name}, stats['hits']) for name, stats in cache_stats.items()])
+    lines += render_samples('emotion_cache_misses_total', 'counter', 'Predictions not found in the cache',
+                            [({'modality': name}, stats['misses']) for name, stats in cache_stats.items()])
+    lines += render_samples('emotion_cache_entries', 'gauge', 'Predictions currently cached',
+                            [({'modality': name}, stats['size']) for name, stats in cache_stats.items()])
+    lines += render_samples('inference_queue_depth', 'gauge', 'Inputs waiting for an inference worker',
+                            [({'queue': name}, stats['queue_depth']) for name, stats in queue_stats.items()])
+    lines += render_samples('inference_running', 'gauge', 'Forward passes currently running',
+                            [({'queue': name}, stats['running']) for name, stats in queue_stats.items()])
+    lines += render_samples('inference_completed_total', 'counter', 'Inputs that have finished inference',
+                            [({'queue': name}, stats['completed']) for name, stats in queue_stats.items()])
+    lines += render_samples('inference_rejected_total', 'counter', 'Requests turned away because the queue was full',
+                            [({'queue': name}, stats['rejected']) for name, stats in queue_stats.items()])
+    lines += render_samples('inference_max_wait_seconds', 'gauge', 'The longest time an input has waited in the queue',
+                            [({'queue': name}, stats['max_wait_ms'] / 1000) for name, stats in queue_stats.items()])
+    return lines
+
+register_collector(emotion_metrics)
+
 # register the endpoints for the emotion detection routes with the flask app
 def register_emotion_routes(app):
     app.route('/api/detect-emotion', methods=['POST'])(detect_emotion)
     app.route('/api/detect-text-emotion', methods=['POST'])(detect_text_emotion)
-    app.route('/api/detect-audio-emotion', methods=['POST'])(detect_audio_emotion)
\ No newline at end of file
+    app.route('/api/detect-text-emotion/bulk', methods=['POST'])(detect_text_emotion_bulk)
+    app.route('/api/detect-audio-emotion', methods=['POST'])(detect_audio_emotion)
+    app.route('/api/detect-audio-emotion/timeline', methods=['POST'])(detect_audio_emotion_timeline)
+    app.route('/api/detect-multimodal-emotion', methods=['POST'])(detect_multimodal_emotion)
+    app.route('/api/detect-video-emotion', methods=['POST'])(detect_video_emotion)
+    app.route('/api/emotion-cache/stats', methods=['GET'])(emotion_cache_stats)
+    app.route('/api/inference/stats', methods=['GET'])(inference_stats)
\ No newline at end of file
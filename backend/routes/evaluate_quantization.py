@@ -0,0 +1,184 @@
+# this script compares the quantized emotion models against the fp32 models on a local set of samples
+# it reports how often the predictions agree, the change in accuracy (when labels are given) and the speed of each model
+#
+# the samples folder is laid out as:
+#   samples/face/<label>/<image files>   (images can also sit directly in samples/face/ when there is no label)
+#   samples/text.jsonl                   (one {"text": ..., "label": ...} per line, the label is optional)
+#   samples/audio/<label>/<audio files>  (audio can also sit directly in samples/audio/ when there is no label)
+#
+# usage: python routes/evaluate_quantization.py samples --precision int8 --output report.json
+
+import os
+import sys
+import io
+import json
+import time
+import argparse
+
+# allow the routes package to be imported when this file is run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from routes.audio_decoding import decode_audio
+from routes.image_decoding import open_downscaled_image, processor_target_size
+from routes.emotion_detection import (
+    load_face_model, load_text_model, load_audio_model,
+    classify_image, classify_text_batch, classify_audio, prepare_audio_for_analysis,
+    AUDIO_SAMPLE_RATE, MAX_IMAGE_PIXELS
+)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.m4a')
+
+
+# find the sample files in a folder, using the name of the sub-folder as the label
+def find_labelled_files(folder, extensions):
+    samples = []
+    if not os.path.isdir(folder):
+        return samples
+    for root, _, files in os.walk(folder):
+        label = None if os.path.samefile(root, folder) else os.path.basename(root)
+        for name in sorted(files):
+            if name.lower().endswith(extensions):
+                samples.append((os.path.join(root, name), label))
+    return samples
+
+
+def load_text_samples(path):
+    samples = []
+    if not os.path.exists(path):
+        return samples
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                samples.append((item['text'], item.get('label')))
+    return samples
+
+
+# run one model over the inputs, returning the probability rows and the average time per sample in milliseconds
+def run_model(predict, inputs):
+    start = time.perf_counter()
+    rows = [predict(x) for x in inputs]
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return rows, elapsed_ms / max(1, len(inputs))
+
+
+def accuracy(rows, labels, id2label):
+    labelled = [(row, label) for row, label in zip(rows, labels) if label is not None]
+    if not labelled:
+        return None
+    correct = sum(1 for row, label in labelled if id2label[int(row.argmax())].lower() == label.lower())
+    return correct / len(labelled)
+
+
+# compare the fp32 and quantized probabilities for one modality
+def compare(name, baseline_rows, quantized_rows, labels, id2label, baseline_ms, quantized_ms):
+    agreement = sum(int(a.argmax()) == int(b.argmax()) for a, b in zip(baseline_rows, quantized_rows))
+    differences = [float((a - b).abs().max()) for a, b in zip(baseline_rows, quantized_rows)]
+    baseline_accuracy = accuracy(baseline_rows, labels, id2label)
+    quantized_accuracy = accuracy(quantized_rows, labels, id2label)
+
+    return {
+        'modality': name,
+        'samples': len(baseline_rows),
+        'top1_agreement': agreement / len(baseline_rows),
+        'mean_max_probability_difference': sum(differences) / len(differences),
+        'max_probability_difference': max(differences),
+        'fp32_accuracy': baseline_accuracy,
+        'quantized_accuracy': quantized_accuracy,
+        'accuracy_delta': (quantized_accuracy - baseline_accuracy) if baseline_accuracy is not None else None,
+        'fp32_ms_per_sample': baseline_ms,
+        'quantized_ms_per_sample': quantized_ms,
+        'speedup': baseline_ms / quantized_ms if quantized_ms else None
+    }
+
+
+def evaluate_face(samples_dir, precision):
+    samples = find_labelled_files(os.path.join(samples_dir, 'face'), IMAGE_EXTENSIONS)
+    if not samples:
+        return None
+    labels = [label for _, label in samples]
+
+    processor, baseline = load_face_model(precision='fp32')
+    # decode the images the same way the endpoint does, so the report measures the pipeline that is served
+    images = []
+    for path, _ in samples:
+        with open(path, 'rb') as f:
+            images.append(open_downscaled_image(io.BytesIO(f.read()), processor_target_size(processor), MAX_IMAGE_PIXELS))
+    baseline_rows, baseline_ms = run_model(lambda image: classify_image(image, processor, baseline), images)
+    id2label = baseline.config.id2label
+    del baseline
+
+    processor, quantized = load_face_model(precision=precision)
+    quantized_rows, quantized_ms = run_model(lambda image: classify_image(image, processor, quantized), images)
+    return compare('face', baseline_rows, quantized_rows, labels, id2label, baseline_ms, quantized_ms)
+
+
+def evaluate_text(samples_dir, precision):
+    samples = load_text_samples(os.path.join(samples_dir, 'text.jsonl'))
+    if not samples:
+        return None
+    texts = [text for text, _ in samples]
+    labels = [label for _, label in samples]
+
+    baseline = load_text_model(precision='fp32')
+    baseline_rows, baseline_ms = run_model(lambda text: classify_text_batch([text], models=baseline)[0], texts)
+    id2label = baseline[1].config.id2label
+    del baseline
+
+    quantized = load_text_model(precision=precision)
+    quantized_rows, quantized_ms = run_model(lambda text: classify_text_batch([text], models=quantized)[0], texts)
+    return compare('text', baseline_rows, quantized_rows, labels, id2label, baseline_ms, quantized_ms)
+
+
+def evaluate_audio(samples_dir, precision):
+    samples = find_labelled_files(os.path.join(samples_dir, 'audio'), AUDIO_EXTENSIONS)
+    if not samples:
+        return None
+    labels = [label for _, label in samples]
+
+    extractor, baseline = load_audio_model(precision='fp32')
+    # decode, trim the silence and cap the length the same way the endpoint does, so the report measures the pipeline that is served
+    clips = []
+    for path, _ in samples:
+        with open(path, 'rb') as f:
+            clips.append(prepare_audio_for_analysis(decode_audio(f.read(), AUDIO_SAMPLE_RATE), baseline)[0])
+
+    baseline_rows, baseline_ms = run_model(lambda clip: classify_audio(clip, AUDIO_SAMPLE_RATE, extractor, baseline), clips)
+    id2label = baseline.config.id2label
+    del baseline
+
+    extractor, quantized = load_audio_model(precision=precision)
+    quantized_rows, quantized_ms = run_model(lambda clip: classify_audio(clip, AUDIO_SAMPLE_RATE, extractor, quantized), clips)
+    return compare('audio', baseline_rows, quantized_rows, labels, id2label, baseline_ms, quantized_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare quantized emotion models against the fp32 baseline")
+    parser.add_argument('samples_dir', help="folder containing face/, text.jsonl and audio/ samples")
+    parser.add_argument('--precision', default='int8', choices=['int8', 'bf16'])
+    parser.add_argument('--output', help="file to write the json report to (printed if not given)")
+    args = parser.parse_args()
+
+    report = {'precision': args.precision, 'results': []}
+    for evaluate in (evaluate_face, evaluate_text, evaluate_audio):
+        result = evaluate(args.samples_dir, args.precision)
+        if result is not None:
+            report['results'].append(result)
+            print(f"{result['modality']}: {result['samples']} samples, "
+                  f"{result['top1_agreement']:.1%} agreement, {result['speedup'] or 0:.2f}x speed", file=sys.stderr)
+
+    if not report['results']:
+        print(f"No samples found in {args.samples_dir}", file=sys.stderr)
+        sys.exit(1)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
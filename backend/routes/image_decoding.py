@@ -0,0 +1,70 @@
+# this script decodes uploaded images close to the size the face model needs, rather than at full resolution
+# jpeg images are decoded at a reduced scale straight from the file, other formats are reduced right after decoding
+
+import io
+import base64
+import binascii
+from PIL import Image
+
+# base64 is decoded in pieces of this many characters, a multiple of 4 so each piece decodes on its own
+BASE64_CHUNK_CHARS = 4 * 256 * 1024
+
+
+# raised when an image has more pixels than we are willing to decode
+class ImageTooLargeError(Exception):
+    pass
+
+
+# decode base64 (optionally a data url) into a stream, in pieces, without first making a stripped copy of the string
+def decode_base64_to_stream(data):
+    start = data.find(',') + 1 # skip the data url prefix if there is one
+    stream = io.BytesIO()
+    try:
+        for i in range(start, len(data), BASE64_CHUNK_CHARS):
+            stream.write(binascii.a2b_base64(data[i:i + BASE64_CHUNK_CHARS]))
+    except binascii.Error:
+        # line breaks or spaces can split the pieces unevenly, so fall back to decoding in one go
+        stream = io.BytesIO(base64.b64decode(data[start:]))
+    stream.seek(0)
+    return stream
+
+
+# get the (width, height) the image processor resizes images to
+def processor_target_size(processor, default=(224, 224)):
+    size = getattr(processor, 'size', None) or {}
+    if 'height' in size and 'width' in size:
+        return size['width'], size['height']
+    if 'shortest_edge' in size:
+        return size['shortest_edge'], size['shortest_edge']
+    return default
+
+
+# open an image and decode it at the smallest size that is still at least the target size
+def open_downscaled_image(stream, target_size, max_pixels):
+    image = Image.open(stream) # only reads the header, the pixels are decoded later
+
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLargeError(f'Image is too large ({width}x{height}), the maximum is {max_pixels} pixels')
+
+    target_width, target_height = target_size
+    if image.format == 'JPEG':
+        # let the jpeg decoder scale down by 1/2, 1/4 or 1/8 while decoding
+        image.draft('RGB', (target_width, target_height))
+    else:
+        factor = min(width // max(1, target_width), height // max(1, target_height))
+        if factor >= 2:
+            try:
+                image = image.reduce(factor)
+            except ValueError:
+                pass # some modes (such as palette images) cannot be reduced, they are resized by the processor instead
+
+    # flatten transparency onto white and convert everything else to rgb
+    if image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[3])
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    return image
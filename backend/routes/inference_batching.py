@@ -0,0 +1,89 @@
+# this script provides a micro-batching queue for model inference
+# concurrent requests are collected into one batch so the model runs a single forward pass for all of them
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from routes.inference_executor import InferenceQueueFull, QueueStats
+
+
+class MicroBatcher:
+    # batch_fn receives a list of inputs and must return a list of results in the same order
+    # max_queue limits how many inputs can wait, further submissions raise InferenceQueueFull (0 means no limit)
+    def __init__(self, batch_fn, max_batch_size=16, max_wait_ms=10, name="batcher", max_queue=0):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self.max_queue = max(0, int(max_queue))
+        self.stats = QueueStats()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+
+    # start the worker thread on first use (and again after a fork, as threads do not survive it)
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+            if self._worker_pid != os.getpid():
+                self._queue = queue.Queue() # a queue copied from the parent process may hold stale items
+            self._worker = threading.Thread(target=self._run, name=f"{self.name}-worker", daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    # add an item to the queue, the returned future resolves with this item's own result
+    def submit(self, item):
+        self._ensure_worker()
+        if self.max_queue and self._queue.qsize() >= self.max_queue:
+            self.stats.reject()
+            raise InferenceQueueFull(self.name, self.stats.retry_after())
+
+        future = Future()
+        self.stats.enqueued()
+        self._queue.put((item, future, time.monotonic()))
+        return future
+
+    # wait for the first item, then keep collecting until the batch is full or the wait time runs out
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            items = [item for item, _, _ in batch]
+            futures = [future for _, future, _ in batch]
+
+            started_at = time.monotonic()
+            self.stats.started(started_at - min(enqueued_at for _, _, enqueued_at in batch), count=len(batch))
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: expected {len(items)} results, got {len(results)}")
+            except Exception as e:
+                self.stats.finished(time.monotonic() - started_at, count=len(batch))
+                # every caller in the failed batch receives the error
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.stats.finished(time.monotonic() - started_at, count=len(batch))
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,121 @@
+# this script runs model inference on a dedicated, bounded pool of threads for each modality
+# when too many requests are already waiting, new ones are turned away straight away instead of queueing without limit
+
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# raised when an inference queue is full, retry_after is a suggested wait in seconds
+class InferenceQueueFull(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"The {name} inference queue is full, please try again in {retry_after} seconds")
+        self.name = name
+        self.retry_after = retry_after
+
+
+# keeps count of how many requests are waiting and running, and how long they waited
+class QueueStats:
+    def __init__(self, workers=1):
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.service_seconds_total = 0.0
+
+    def enqueued(self, count=1):
+        with self._lock:
+            self.queued += count
+
+    def cancelled(self, count=1):
+        with self._lock:
+            self.queued -= count
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def started(self, wait_seconds, count=1):
+        with self._lock:
+            self.queued -= count
+            self.running += 1
+            self.wait_seconds_total += wait_seconds * count
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+    def finished(self, service_seconds, count=1):
+        with self._lock:
+            self.running -= 1
+            self.completed += count
+            self.service_seconds_total += service_seconds
+
+    # a rough guess of how long the current queue will take to clear
+    def retry_after(self):
+        with self._lock:
+            average_service = self.service_seconds_total / self.completed if self.completed else 1.0
+            return max(1, math.ceil(average_service * (self.queued + self.running) / self.workers))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'queue_depth': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'average_wait_ms': (self.wait_seconds_total / self.completed * 1000) if self.completed else 0.0,
+                'max_wait_ms': self.wait_seconds_max * 1000
+            }
+
+
+class InferenceExecutor:
+    def __init__(self, name, workers=1, max_queue=16):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.max_queue = max(0, int(max_queue))
+        self.stats = QueueStats(self.workers)
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue) # running plus waiting
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    # create the thread pool on first use (and again after a fork, as threads do not survive it)
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{self.name}-inference")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    # queue a call, raising InferenceQueueFull if there is no room, the returned future resolves with its result
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            self.stats.reject()
+            raise InferenceQueueFull(self.name, self.stats.retry_after())
+
+        enqueued_at = time.monotonic()
+        self.stats.enqueued()
+
+        def task():
+            started_at = time.monotonic()
+            self.stats.started(started_at - enqueued_at)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.stats.finished(time.monotonic() - started_at)
+                self._slots.release()
+
+        try:
+            return self._get_executor().submit(task)
+        except Exception:
+            self.stats.cancelled()
+            self._slots.release()
+            raise
+
+    # run a call on the executor and wait for its result
+    def run(self, fn, *args, **kwargs):
+        return self.submit(fn, *args, **kwargs).result()
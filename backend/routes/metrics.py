@@ -0,0 +1,95 @@
+# this script keeps simple latency histograms and renders them, along with other gauges, in the prometheus text format
+# the values are kept per process, so with several gunicorn workers each one reports its own
+
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds in seconds of the histogram buckets, from a millisecond up to half a minute
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# functions that return extra metric lines when /metrics is rendered, such as cache and queue gauges
+_collectors = []
+_histograms = []
+
+
+# escape a label value as the prometheus text format requires
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+# format a set of labels as {name="value",...}, or nothing if there are none
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class Histogram:
+    def __init__(self, name, description, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {} # label values -> [bucket counts, sum, count]
+        _histograms.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    # time the body of a with block and record it
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, list(counts), total, count) for key, (counts, total, count) in self._series.items())
+        for key, counts, total, count in series:
+            labels = dict(zip(self.labelnames, key))
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{format_labels({**labels, "le": repr(bound)})} {bucket_count}')
+            lines.append(f'{self.name}_bucket{format_labels({**labels, "le": "+Inf"})} {count}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {count}')
+        return lines
+
+
+# render a metric with one value per set of labels, samples is a list of (labels, value) pairs
+def render_samples(name, metric_type, description, samples):
+    lines = [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}']
+    lines.extend(f'{name}{format_labels(labels)} {value}' for labels, value in samples)
+    return lines
+
+
+# add a function that returns extra metric lines each time /metrics is rendered
+def register_collector(collector):
+    _collectors.append(collector)
+
+
+# render every histogram and collector in the prometheus text format
+def render_metrics():
+    lines = []
+    for histogram in _histograms:
+        lines.extend(histogram.render())
+    for collector in _collectors:
+        try:
+            lines.extend(collector())
+        except Exception as e:
+            print(f"Error collecting metrics: {e}")
+    return '\n'.join(lines) + '\n'
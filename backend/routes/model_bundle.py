@@ -0,0 +1,72 @@
+# this script reads and checks the packed model bundle made by pack_models.py
+# the bundle keeps every model in one folder (saved_models/bundle/<modality>/) with a manifest of checksums,
+# so the files can be checked without network access and the weights memory-mapped straight from the bundle
+
+import os
+import json
+import hashlib
+
+MANIFEST_NAME = "manifest.json"
+BUNDLE_FORMAT = 1
+
+
+# raised when the bundle is missing files or they do not match the manifest
+class BundleError(Exception):
+    pass
+
+
+# the sha256 of a file, read in pieces so large weights are not loaded into memory
+def file_sha256(path, chunk_size=4 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# a revision for a set of files, which changes whenever any file's contents change
+def files_revision(files):
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(f"{name}:{files[name]['sha256']}\n".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+# read the bundle's manifest, or None if there is no bundle
+def read_manifest(bundle_dir):
+    path = os.path.join(bundle_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != BUNDLE_FORMAT:
+        raise BundleError(f"Unsupported bundle format {manifest.get('format')} in {path}, re-run pack_models.py")
+    return manifest
+
+
+# check every file in the manifest is present and the right size, and (when full is set) has the right checksum
+# returns a list of the problems found, which is empty when the bundle is intact
+def verify_bundle(bundle_dir, manifest, full=True):
+    problems = []
+    for modality, entry in manifest['models'].items():
+        for name, info in entry['files'].items():
+            path = os.path.join(bundle_dir, modality, name)
+            if not os.path.exists(path):
+                problems.append(f"{modality}/{name} is missing")
+            elif os.path.getsize(path) != info['size']:
+                problems.append(f"{modality}/{name} is {os.path.getsize(path)} bytes, expected {info['size']}")
+            elif full and file_sha256(path) != info['sha256']:
+                problems.append(f"{modality}/{name} does not match its checksum")
+    return problems
+
+
+# open the bundle for loading, returning its manifest (or None if there is no bundle)
+# sizes are always checked, the slower checksum check only when verify is set
+def open_bundle(bundle_dir, verify=False):
+    manifest = read_manifest(bundle_dir)
+    if manifest is None:
+        return None
+    problems = verify_bundle(bundle_dir, manifest, full=verify)
+    if problems:
+        raise BundleError(f"The model bundle in {bundle_dir} is damaged: {'; '.join(problems)}. Re-run pack_models.py.")
+    return manifest
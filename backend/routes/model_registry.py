@@ -0,0 +1,113 @@
+# this script keeps track of the loaded ai models, loading each one the first time it is needed
+# when a memory budget is set, the least recently used models are unloaded to stay within it
+
+import gc
+import os
+import threading
+from collections import OrderedDict
+
+
+# get the resident memory of this process in megabytes, or None if it cannot be read on this platform
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class ModelRegistry:
+    def __init__(self, memory_budget_mb=0):
+        self.memory_budget_mb = memory_budget_mb # 0 means no budget
+        self._loaders = {}
+        self._models = OrderedDict() # ordered from least to most recently used
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._revision_readers = {}
+        self._revisions = {} # the revision of each model's files, read when it was loaded
+
+    # register a function that loads a model, it is only called when the model is first needed
+    # the optional revision function identifies the version of the model's files, it is called when the model is loaded
+    def register(self, name, loader, revision=None):
+        self._loaders[name] = loader
+        self._load_locks[name] = threading.Lock()
+        self._revision_readers[name] = revision
+
+    def names(self):
+        return list(self._loaders)
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models)
+
+    # get a model, loading it if needed, and mark it as the most recently used
+    def get(self, name):
+        if name not in self._loaders:
+            raise KeyError(f"Unknown model: {name}")
+
+        with self._lock:
+            if name in self._models:
+                self._models.move_to_end(name)
+                return self._models[name]
+
+        # only one thread loads each model, the others wait for it to finish
+        with self._load_locks[name]:
+            with self._lock:
+                if name in self._models:
+                    self._models.move_to_end(name)
+                    return self._models[name]
+
+            revision = self._read_revision(name) # kept with the model, so requests do not read its files again
+            loaded_model = self._loaders[name]()
+
+            with self._lock:
+                self._models[name] = loaded_model
+                self._models.move_to_end(name)
+                self._revisions[name] = revision
+
+        self._enforce_budget(keep=name)
+        return loaded_model
+
+    # get the revision of a model's files without reading them again, it is read here only if the model has not been loaded
+    def revision(self, name):
+        if name not in self._loaders:
+            raise KeyError(f"Unknown model: {name}")
+        with self._lock:
+            if name in self._revisions:
+                return self._revisions[name]
+        revision = self._read_revision(name)
+        with self._lock:
+            return self._revisions.setdefault(name, revision)
+
+    def _read_revision(self, name):
+        reader = self._revision_readers[name]
+        return reader() if reader is not None else None
+
+    # unload a model, requests already using it keep their reference until they finish
+    # its revision is forgotten too, as its files may have changed by the time it is loaded again
+    def evict(self, name):
+        with self._lock:
+            removed = self._models.pop(name, None)
+            self._revisions.pop(name, None)
+        if removed is not None:
+            del removed
+            gc.collect()
+            print(f"Unloaded model '{name}' to stay within the memory budget")
+
+    # unload the least recently used models until the process is back within the memory budget
+    def _enforce_budget(self, keep):
+        if not self.memory_budget_mb:
+            return
+
+        while True:
+            rss = current_rss_mb()
+            if rss is None or rss <= self.memory_budget_mb:
+                return
+
+            with self._lock:
+                candidates = [name for name in self._models if name != keep]
+            if not candidates:
+                return
+
+            self.evict(candidates[0])
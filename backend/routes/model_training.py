@@ -1,41 +1,78 @@
 # this script handles model training for both the Iris dataset and custom datasets
 # it includes data preprocessing, model training, evaluation, and visualisation
 
-import io
+import re
 import json
-import base64
 import traceback
 import numpy as np
 import pandas as pd
 import os
+import copy
+import time
+import tempfile
 import uuid
+import threading
+import joblib
+from joblib import Parallel, delayed, parallel_config
 
 # configure matplotlib to use the 'Agg' backend for server-side plotting without a display
 import matplotlib 
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 
-from flask import request, jsonify
+from flask import request, jsonify, send_file
 
 
 from sklearn.datasets import load_iris
 from sklearn.tree import DecisionTreeClassifier, plot_tree
 from sklearn.neighbors import KNeighborsClassifier
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import train_test_split, cross_validate, StratifiedKFold, KFold
 from sklearn.preprocessing import StandardScaler, FunctionTransformer, OneHotEncoder, LabelEncoder # for preprocessing
 from sklearn.impute import SimpleImputer # for imputing missing values
 from sklearn.compose import ColumnTransformer # for column transformations
 from sklearn.pipeline import Pipeline # for pipelines
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix, ConfusionMatrixDisplay # for metrics
+from sklearn.base import clone
+from sklearn.metrics import make_scorer, accuracy_score, precision_score, recall_score, f1_score, confusion_matrix, ConfusionMatrixDisplay # for metrics
+
+from routes.result_cache import ResultCache, make_cache_key
+from routes.dataset_store import load_dataset
 
 STATIC_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'static')
 VIS_DIR = os.path.join(STATIC_FOLDER, 'visualisations')
 os.makedirs(VIS_DIR, exist_ok=True)
 
+# the deepest level of a decision tree drawn in the svg visualisation, deeper nodes are summarised
+TREE_SVG_MAX_DEPTH = int(os.environ.get("TREE_SVG_MAX_DEPTH", 6))
+
+# the most hyperparameter values a sweep can try, and how many processes it uses (-1 uses every core)
+TRAINING_SWEEP_MAX_VALUES = int(os.environ.get("TRAINING_SWEEP_MAX_VALUES", 50))
+TRAINING_SWEEP_JOBS = int(os.environ.get("TRAINING_SWEEP_JOBS", -1))
+
+# the most folds cross-validation can use, and how many processes fit them (-1 uses every core)
+TRAINING_CV_MAX_FOLDS = int(os.environ.get("TRAINING_CV_MAX_FOLDS", 10))
+TRAINING_CV_JOBS = int(os.environ.get("TRAINING_CV_JOBS", -1))
+
+# pyplot keeps global state, so only one thread draws with it at a time
+plot_lock = threading.Lock()
+
+# settings for the training cache, a repeated configuration returns the cached results without fitting or plotting again
+TRAINING_CACHE_SIZE = int(os.environ.get("TRAINING_CACHE_SIZE", 64))
+TRAINING_CACHE_TTL_SECONDS = float(os.environ.get("TRAINING_CACHE_TTL_SECONDS", 3600))
+
+# fitted pipelines and their results, keyed by a fingerprint of the training configuration
+training_cache = ResultCache(maxsize=TRAINING_CACHE_SIZE, ttl=TRAINING_CACHE_TTL_SECONDS)
+
+# the results are also saved to files, so every gunicorn worker and training process can reuse them
+TRAINING_RESULTS_DIR = os.environ.get("TRAINING_RESULTS_DIR", os.path.join(tempfile.gettempdir(), "training_results"))
+
 # define a model error, initially nothing
 class ModelError(Exception):
     pass
 
+# raised when a training request refers to a stored dataset that does not exist (or has expired)
+class DatasetNotFoundError(ModelError):
+    pass
+
 # log transform outliers to avoid skewness, making the data more suitable for modeling.
 # does this for values extremely above the upper quartile or below the lower quartile
 def log_transform_outliers(X):
@@ -89,10 +126,11 @@ def validate_input_data(data):
 
 # validate custom datasets
 def validate_custom_dataset(data):
-    if 'customData' not in data:
+    if data.get('datasetId'):
+        pass # the stored dataset is checked when it is loaded
+    elif 'customData' not in data:
         raise ModelError("Custom dataset is required when dataset type is 'custom'")
-    
-    if not data['customData']:
+    elif not data['customData']:
         raise ModelError("Custom dataset cannot be empty")
     
     if 'targetFeature' not in data:
@@ -101,54 +139,86 @@ def validate_custom_dataset(data):
     if 'selectedFeatures' not in data:
         raise ModelError("Selected features must be specified for custom dataset")
 
-# create a visualisation for the decision tree
-def create_visualisation(model_or_pipeline, model_type, feature_names=None, class_names=None):
-    model_to_plot = model_or_pipeline
+# the model step of a pipeline, or the model itself if it is not a pipeline
+def pipeline_model(model_or_pipeline):
     if isinstance(model_or_pipeline, Pipeline):
+        return model_or_pipeline.named_steps.get('model')
+    return model_or_pipeline
+
+# export a fitted decision tree as compact json, so the frontend can draw it without a server-side render
+# nodes are listed in the tree's own order (the root first), leaves have no feature, threshold or children
+def export_tree(tree_model, feature_names=None, class_names=None):
+    tree = tree_model.tree_
+    feature_names = list(feature_names) if feature_names is not None else [f'feature_{i}' for i in range(tree.n_features)]
+    # the stored values are class fractions in recent versions of sklearn, so scale them back up to counts
+    counts = tree.value[:, 0, :] * tree.weighted_n_node_samples[:, None] if tree.value[:, 0, :].max() <= 1 else tree.value[:, 0, :]
+
+    nodes = []
+    for node_id in range(tree.node_count):
+        node = {
+            'id': node_id,
+            'samples': int(tree.n_node_samples[node_id]),
+            'impurity': round(float(tree.impurity[node_id]), 4),
+            'class_counts': [int(round(c)) for c in counts[node_id]]
+        }
+        if tree.children_left[node_id] != tree.children_right[node_id]: # a split rather than a leaf
+            node.update({
+                'feature': feature_names[tree.feature[node_id]],
+                'threshold': round(float(tree.threshold[node_id]), 4),
+                'left': int(tree.children_left[node_id]),
+                'right': int(tree.children_right[node_id])
+            })
+        nodes.append(node)
+
+    return {
+        'class_names': [str(c) for c in class_names] if class_names is not None else [str(c) for c in tree_model.classes_],
+        'max_depth': int(tree_model.get_depth()),
+        'nodes': nodes
+    }
+
+def tree_file_path(tree_id, extension):
+    return os.path.join(VIS_DIR, f"tree_{tree_id}.{extension}")
+
+# keep the fitted tree so its svg can be drawn later, only when it is asked for
+def save_tree_for_rendering(tree_id, tree_model, feature_names=None, class_names=None):
+    path = tree_file_path(tree_id, 'joblib')
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    joblib.dump({'model': tree_model, 'feature_names': feature_names, 'class_names': class_names}, temp_path)
+    os.replace(temp_path, path)
+
+# draw a stored tree as an svg, down to TREE_SVG_MAX_DEPTH levels, and keep the svg for later requests
+# returns the path to the svg, or None if there is no stored tree with this id
+def render_tree_svg(tree_id):
+    svg_path = tree_file_path(tree_id, 'svg')
+    if os.path.exists(svg_path):
+        return svg_path
+    try:
+        stored = joblib.load(tree_file_path(tree_id, 'joblib'))
+    except FileNotFoundError:
+        return None
+
+    tree_model = stored['model']
+    depth = min(tree_model.get_depth(), TREE_SVG_MAX_DEPTH)
+    # size the figure by the number of nodes on the widest drawn level rather than one fixed, very large size
+    widest = max(1, min(2 ** depth, tree_model.get_n_leaves()))
+
+    with plot_lock:
+        fig = plt.figure(figsize=(min(4 + 2.2 * widest, 200), 2 + 1.8 * (depth + 1)), facecolor='white')
         try:
-            model_to_plot = model_or_pipeline.named_steps['model']
-        except KeyError:
-            print("Error: Could not find 'model' step in the pipeline for visualisation.")
-            return None
-            
-    # if the model is a decision tree
-    if model_type == 'decision_tree' and isinstance(model_to_plot, DecisionTreeClassifier):
-        try:
-            plt.close('all') # close all existing plots
-            fig = plt.figure(figsize=(70, 50), facecolor='white') # create a new figure
-            effective_class_names = class_names if class_names is not None else [] # if the class names are not none, use them, otherwise use an empty list
-            
-            # plot the tree
-            plot_tree(model_to_plot,
-                  feature_names=feature_names,
-                  class_names=effective_class_names,
-                  filled=True,
-                  rounded=True,
-                  fontsize=5,
-                  precision=2)
-            
-            plt.subplots_adjust(left=0.01, right=0.99, top=0.99, bottom=0.01)
-            plt.tight_layout(pad=3.0)
-            
-            # save the plot to a file for viewing
-            filename = f"tree_{uuid.uuid4()}.pdf"
-            filepath = os.path.join(VIS_DIR, filename)
-            
-            plt.savefig(filepath, format='pdf', bbox_inches='tight', facecolor='white', edgecolor='none')
+            plot_tree(tree_model,
+                      max_depth=TREE_SVG_MAX_DEPTH,
+                      feature_names=stored['feature_names'],
+                      class_names=stored['class_names'] or [],
+                      filled=True,
+                      rounded=True,
+                      fontsize=8,
+                      precision=2)
+            temp_path = f"{svg_path}.{uuid.uuid4().hex}.tmp"
+            fig.savefig(temp_path, format='svg', bbox_inches='tight', facecolor='white', edgecolor='none')
+            os.replace(temp_path, svg_path)
+        finally:
             plt.close(fig)
-            
-            # return the url of the visualisation, so it can be displayed
-            visualisation_url = f"/static/visualisations/{filename}"
-            print(f"Visualisation saved to: {filepath}")
-            print(f"Returning URL: {visualisation_url}")
-            return visualisation_url
-             
-        except Exception as e:
-            print(f"Error creating visualision: {str(e)}")
-            traceback.print_exc()
-            plt.close('all')
-            return None
-    return None
+    return svg_path
 
 # create insights for the model, including the statistics and key features
 def create_model_insights(model_or_pipeline, feature_names, model_type):
@@ -186,262 +256,509 @@ def create_model_insights(model_or_pipeline, feature_names, model_type):
 
     return insights
 
-# create a confusion matrix for the model
-def create_confusion_matrix(model_or_pipeline, X, y, class_names=None):
+# build a confusion matrix from predictions that have already been made, with a url for its image
+# the matrix is stored by a hash of its contents, so the image is only drawn when asked for and shared by identical matrices
+def create_confusion_matrix(y, y_pred, labels, class_names=None):
+    cm = confusion_matrix(y, y_pred, labels=labels)
+    display_labels = [str(cn) for cn in class_names] if class_names is not None else [str(label) for label in labels]
+    spec = {'labels': display_labels, 'matrix': cm.tolist()}
+
+    matrix_id = make_cache_key(json.dumps(spec, sort_keys=True))[:32]
+    spec_path = confusion_matrix_path(matrix_id, 'json')
+    if not os.path.exists(spec_path):
+        temp_path = f"{spec_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(spec, f)
+        os.replace(temp_path, spec_path)
+
+    return {**spec, 'image_url': f"/api/train-model/confusion-matrix/{matrix_id}.png"}
+
+def confusion_matrix_path(matrix_id, extension):
+    return os.path.join(VIS_DIR, f"cm_{matrix_id}.{extension}")
+
+# draw a stored confusion matrix as a png and keep it for later requests
+# returns the path to the png, or None if there is no stored matrix with this id
+def render_confusion_matrix_png(matrix_id):
+    png_path = confusion_matrix_path(matrix_id, 'png')
+    if os.path.exists(png_path):
+        return png_path
     try:
-        y_pred = model_or_pipeline.predict(X) # predict the values
-        
-        # create the confusion matrix
-        cm = confusion_matrix(y, y_pred)
+        with open(confusion_matrix_path(matrix_id, 'json')) as f:
+            spec = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    with plot_lock:
         fig, ax = plt.subplots(figsize=(10, 8))
-        display_labels = [str(cn) for cn in class_names] if class_names is not None else None
-        disp = ConfusionMatrixDisplay(confusion_matrix=cm, display_labels=display_labels)
-        disp.plot(cmap=plt.cm.Blues, ax=ax)
-        plt.title('Confusion Matrix')
-        plt.grid(False)
-        
-        # save the plot to a buffer and encode it as a base64 string
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight')
-        plt.close(fig)
-        buf.seek(0)
-        encoded_img = base64.b64encode(buf.read()).decode('utf-8')
-        return encoded_img
-        
-    except Exception as e:
-        print(f"ERROR creating confusion matrix: {str(e)}")
-        traceback.print_exc()
-        plt.close('all')
+        try:
+            disp = ConfusionMatrixDisplay(confusion_matrix=np.array(spec['matrix']), display_labels=spec['labels'])
+            disp.plot(cmap=plt.cm.Blues, ax=ax)
+            ax.set_title('Confusion Matrix')
+            ax.grid(False)
+            temp_path = f"{png_path}.{uuid.uuid4().hex}.tmp"
+            fig.savefig(temp_path, format='png', bbox_inches='tight')
+            os.replace(temp_path, png_path)
+        finally:
+            plt.close(fig)
+    return png_path
+
+# a fingerprint of everything that affects the trained model, the split is always seeded so the same configuration gives the same model
+# hyperparameters that do not apply to the model type are left out, so they do not split the cache
+def training_fingerprint(data):
+    config = {
+        'dataset': data['dataset'],
+        'modelType': data['modelType'],
+        'testSize': float(data['testSize']),
+        'selectedFeatures': data.get('selectedFeatures')
+    }
+    if data.get('cvFolds'):
+        config['cvFolds'] = data['cvFolds']
+    if data['modelType'] == 'decision_tree':
+        config['minSamplesSplit'] = data.get('minSamplesSplit', 2)
+    elif data['modelType'] == 'knn':
+        config['nNeighbors'] = data.get('nNeighbors', 5)
+
+    parts = [json.dumps(config, sort_keys=True, default=str)]
+    if data['dataset'] == 'custom':
+        parts.append(json.dumps(data.get('targetFeature'), default=str))
+        parts.append(json.dumps(data.get('targetCorrections') or {}, sort_keys=True, default=str))
+        if data.get('datasetId'):
+            parts.append(f"dataset:{data['datasetId']}") # the id is already a hash of the stored dataset's contents
+        else:
+            parts.append(json.dumps(data.get('customData'), sort_keys=True, default=str))
+    return make_cache_key(*parts)
+
+# check that the stored tree and matrices the results link to have not been deleted
+def training_artefacts_exist(cache_key, results):
+    if results.get('visualisation_url') and not os.path.exists(tree_file_path(cache_key[:32], 'joblib')):
+        return False
+    for matrix in results['insights'].get('confusion_matrices', {}).values():
+        if not os.path.exists(confusion_matrix_path(matrix['image_url'].rsplit('/', 1)[-1][:-len('.png')], 'json')):
+            return False
+    return True
+
+def training_results_path(cache_key):
+    return os.path.join(TRAINING_RESULTS_DIR, f"{cache_key}.json")
+
+# the cached results for a configuration, from this process's memory or else from the results saved by any process
+# returns None if there are none, they are older than the time to live, or their stored tree or matrices have been deleted
+def cached_training_results(cache_key):
+    cached = training_cache.get(cache_key)
+    if cached is not None:
+        results = cached['results']
+    else:
+        path = training_results_path(cache_key)
+        try:
+            if os.path.getmtime(path) < time.time() - TRAINING_CACHE_TTL_SECONDS:
+                return None
+            with open(path) as f:
+                results = json.load(f)
+        except (OSError, ValueError):
+            return None
+    if not training_artefacts_exist(cache_key, results):
         return None
+    return copy.deepcopy(results)
 
-# train the model
-def train_model(data):
+# keep the results in this process's memory (with the fitted pipeline) and in a file the other processes can read
+def store_training_results(cache_key, pipeline, results):
+    training_cache.set(cache_key, {'pipeline': pipeline, 'results': copy.deepcopy(results)})
     try:
-        print("\nStarting Model Training")
-        validate_input_data(data)
-
-        # initialise variables
-        model_to_evaluate = None
-        X_train_final = None
-        X_test_final = None
-        y_train_actual = None
-        y_test_actual = None
-        feature_names_for_vis = None
-        class_names_for_vis = None
+        os.makedirs(TRAINING_RESULTS_DIR, exist_ok=True)
+        remove_expired_training_results()
+        path = training_results_path(cache_key)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(results, f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Could not save the training results for other workers: {str(e)}")
+
+# delete the saved results that are older than the time to live
+def remove_expired_training_results():
+    cutoff = time.time() - TRAINING_CACHE_TTL_SECONDS
+    for name in os.listdir(TRAINING_RESULTS_DIR):
+        path = os.path.join(TRAINING_RESULTS_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass # another process removed it first
+
+# load the chosen dataset, split it into training and testing sets and set up (but do not fit) its preprocessing
+# returns the whole and split data, the class names, the preprocessing pipeline step and (for iris) the feature names
+def prepare_dataset(data):
+    # if the dataset is iris
+    if data['dataset'] == 'iris':
+        print("Processing Iris dataset...")
+        iris = load_iris()
+        selected_features = data['selectedFeatures']
+        if not selected_features: raise ModelError("Iris: At least one feature must be selected")
         
-        # if the dataset is iris
-        if data['dataset'] == 'iris':
-            print("Processing Iris dataset...")
-            iris = load_iris()
-            selected_features = data['selectedFeatures']
-            if not selected_features: raise ModelError("Iris: At least one feature must be selected")
-            
-            # get indices of selected features
-            feature_indices = [i for i, name in enumerate(iris.feature_names) if name in selected_features]
-            if not feature_indices: raise ModelError("Iris: None of the selected features exist")
-            
-            # extract features and target
-            X = iris.data[:, feature_indices]
-            y = iris.target
-            feature_names_for_vis = [iris.feature_names[i] for i in feature_indices]
-            class_names_for_vis = iris.target_names.tolist()
-
-            # split data into training and testing sets
-            X_train, X_test, y_train, y_test = train_test_split(
-                X, y, test_size=data['testSize'], random_state=99, shuffle=True, stratify=y
-            )
-            
-            y_train_actual = y_train
-            y_test_actual = y_test
-            
-            # set up the model pipeline for reducing data leakage
-            scaler_step = ('scaler', StandardScaler()) # standardise the features
-            if data['modelType'] == 'decision_tree':
-                model_step = ('model', DecisionTreeClassifier(
-                    min_samples_split=data.get('minSamplesSplit', 2),
-                    random_state=99
-                ))
-            elif data['modelType'] == 'knn':
-                model_step = ('model', KNeighborsClassifier(
-                    n_neighbors=data.get('nNeighbors', 5)
-                ))
-            else:
-                 raise ModelError("Invalid modelType specified for Iris.")
-
-            # create the pipeline
-            model_to_evaluate = Pipeline([scaler_step, model_step])
-            print(f"Iris: Created pipeline: {model_to_evaluate.steps}")
-            print(f"Fitting {data['modelType']} pipeline on Iris data...")
+        # get indices of selected features
+        feature_indices = [i for i, name in enumerate(iris.feature_names) if name in selected_features]
+        if not feature_indices: raise ModelError("Iris: None of the selected features exist")
+        
+        # extract features and target
+        X = iris.data[:, feature_indices]
+        y = iris.target
 
-            # fit the pipeline
-            model_to_evaluate.fit(X_train, y_train_actual)
-            print("Iris: Pipeline fitting complete.")
-            print("Iris model fitting complete.")
+        # split data into training and testing sets
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=data['testSize'], random_state=99, shuffle=True, stratify=y
+        )
 
-            X_train_final = X_train
-            X_test_final = X_test
+        # the features are standardised in the pipeline, which reduces data leakage
+        return {
+            'X': X, 'y': y, 'X_train': X_train, 'X_test': X_test, 'y_train': y_train, 'y_test': y_test,
+            'class_names': iris.target_names.tolist(),
+            'feature_names': [iris.feature_names[i] for i in feature_indices],
+            'preprocessor': ('scaler', StandardScaler())
+        }
 
-        # if the dataset is custom
-        elif data['dataset'] == 'custom':
-            print("Processing Custom dataset...")
-            validate_custom_dataset(data)
+    # if the dataset is custom
+    elif data['dataset'] == 'custom':
+        print("Processing Custom dataset...")
+        validate_custom_dataset(data)
+        # a dataset uploaded earlier is loaded from the store, otherwise the rows are sent with the request
+        if data.get('datasetId'):
+            df = load_dataset(data['datasetId'])
+            if df is None: raise DatasetNotFoundError("The uploaded dataset was not found or has expired, please upload it again.")
+        else:
             df = pd.DataFrame(data['customData'])
-            
-            target_feature_name = data['targetFeature']
-
-            # if there are target corrections set by the user, apply them
-            corrections = data.get('targetCorrections', {})
-            if corrections and target_feature_name in df.columns:
-                df[target_feature_name] = df[target_feature_name].replace(corrections)
-
-            if target_feature_name not in df.columns: raise ModelError(f"Target '{target_feature_name}' not found.")
-            y = df[target_feature_name]
-            
-            selected_features = data['selectedFeatures']
-            if not selected_features: raise ModelError("Custom: At least one feature must be selected")
-            valid_selected_features = [f for f in selected_features if f in df.columns and f != target_feature_name]
-            if not valid_selected_features: raise ModelError("Custom: No valid features selected.")
-            X = df[valid_selected_features]
-
-            # if the target is categorical, encode it
-            if pd.api.types.is_object_dtype(y) or pd.api.types.is_categorical_dtype(y) or pd.api.types.is_bool_dtype(y):
-                 label_encoder = LabelEncoder()
-                 y = label_encoder.fit_transform(y)
-                 class_names_for_vis = label_encoder.classes_.astype(str).tolist()
-            else:
-                 class_names_for_vis = [str(c) for c in np.unique(y)]
-
-
-            X_train, X_test, y_train, y_test = train_test_split(
-                X, y, test_size=data['testSize'], random_state=99, shuffle=True, stratify=y
-            )
-            y_train_actual = y_train
-            y_test_actual = y_test
-
-            numerical_features = X_train.select_dtypes(include=np.number).columns.tolist()
-            categorical_features = X_train.select_dtypes(include=['object', 'category', 'bool']).columns.tolist()
-            print(f"Custom: Numerical features identified: {numerical_features}")
-            print(f"Custom: Categorical features identified: {categorical_features}")
-
-            # define numerical and categortical pipelines
-            # including imputation, log transformation and standardisation, as well as one-hot encoding for categorical features
-            numerical_pipeline = Pipeline([
-                ('imputer', SimpleImputer(strategy='mean')),
-                ('log_transformer', log_transformer_step),
-                ('scaler', StandardScaler())
-            ])
-            categorical_pipeline = Pipeline([
-                ('imputer', SimpleImputer(strategy='most_frequent')),
-                ('onehot', OneHotEncoder(handle_unknown='ignore', sparse_output=False))
-            ])
-            
-            # set up transformers for numerical and categorical features
-            transformers = []
-            if numerical_features: transformers.append(('num', numerical_pipeline, numerical_features))
-            if categorical_features: transformers.append(('cat', categorical_pipeline, categorical_features))
-            if not transformers: raise ModelError("Custom: No numerical or categorical features identified.")
-
-            # create a preprocessor to apply transformations to the features
-            preprocessor = ColumnTransformer(transformers=transformers, remainder='passthrough')
-
-            # initialise the model based on the specified type
-            if data['modelType'] == 'decision_tree':
-                model = DecisionTreeClassifier(
-                    min_samples_split=data.get('minSamplesSplit', 2),
-                    random_state=99
-                )
-            elif data['modelType'] == 'knn':
-                model = KNeighborsClassifier(n_neighbors=data.get('nNeighbors', 5))
-            else:
-                 raise ModelError("Invalid modelType specified for Custom pipeline.")
-
-            # create the full pipeline with the model included
-            model_to_evaluate = Pipeline([('preprocessor', preprocessor), ('model', model)])
-            print(f"Custom: Created pipeline: {model_to_evaluate.steps}")
-
-            print(f"Fitting {data['modelType']} pipeline on custom data...")
-            model_to_evaluate.fit(X_train, y_train_actual)
-            print("Custom: Pipeline fitting complete.")
-            
-            X_train_final = X_train
-            X_test_final = X_test
-
-
-            try:
-                # get feature names from the fitted preprocessor
-                preprocessor_fitted = model_to_evaluate.named_steps['preprocessor']
-                feature_names_for_vis = preprocessor_fitted.get_feature_names_out()
-                feature_names_for_vis = [str(name) for name in feature_names_for_vis]
-                print(f"Custom: Transformed names ({len(feature_names_for_vis)}): {list(feature_names_for_vis)[:15]}...")
-            except Exception as name_err:
-                print(f"Could not get transformed feature names for custom data: {name_err}")
-                final_estimator = model_to_evaluate.named_steps['model']
-                if hasattr(final_estimator, 'n_features_in_'):
-                     feature_names_for_vis = [f'feature_{i}' for i in range(final_estimator.n_features_in_)]
+        
+        target_feature_name = data['targetFeature']
 
-        else:
-            raise ModelError("Invalid dataset type specified")
-
-        if model_to_evaluate is None or X_train_final is None or X_test_final is None:
-             raise ModelError("Model or processed data is missing before evaluation.")
-             
-        # calculate the metrics for the training and testing sets
-        print("Calculating metrics...")
-        print(f"Evaluation: Using model/pipeline object of type: {type(model_to_evaluate)}")
-        y_train_pred = model_to_evaluate.predict(X_train_final)
-        y_test_pred = model_to_evaluate.predict(X_test_final)
-
-        # average is weighted to account for class imbalance by averaging
-        # zero division avoid errors when dealing with classes that are not predicted at all (which would cause a division by zero)
-        metrics = {
-            'train': {
-                'accuracy': float(accuracy_score(y_train_actual, y_train_pred)),
-                'precision': float(precision_score(y_train_actual, y_train_pred, average='weighted', zero_division=0)),
-                'recall': float(recall_score(y_train_actual, y_train_pred, average='weighted', zero_division=0)),
-                'f1': float(f1_score(y_train_actual, y_train_pred, average='weighted', zero_division=0))
-            },
-            'test': {
-                'accuracy': float(accuracy_score(y_test_actual, y_test_pred)),
-                'precision': float(precision_score(y_test_actual, y_test_pred, average='weighted', zero_division=0)),
-                'recall': float(recall_score(y_test_actual, y_test_pred, average='weighted', zero_division=0)),
-                'f1': float(f1_score(y_test_actual, y_test_pred, average='weighted', zero_division=0))
-            }
-        }
+        # if there are target corrections set by the user, apply them
+        corrections = data.get('targetCorrections', {})
+        if corrections and target_feature_name in df.columns:
+            df[target_feature_name] = df[target_feature_name].replace(corrections)
+
+        if target_feature_name not in df.columns: raise ModelError(f"Target '{target_feature_name}' not found.")
+        y = df[target_feature_name]
         
-        # create the visualisation and insights
-        print("Generating visualisations and insights...")
-        visualisation_result = create_visualisation(
-            model_to_evaluate, data['modelType'],
-            feature_names=feature_names_for_vis,
-            class_names=class_names_for_vis
+        selected_features = data['selectedFeatures']
+        if not selected_features: raise ModelError("Custom: At least one feature must be selected")
+        valid_selected_features = [f for f in selected_features if f in df.columns and f != target_feature_name]
+        if not valid_selected_features: raise ModelError("Custom: No valid features selected.")
+        X = df[valid_selected_features]
+
+        # if the target is categorical, encode it
+        if pd.api.types.is_object_dtype(y) or pd.api.types.is_categorical_dtype(y) or pd.api.types.is_bool_dtype(y):
+             label_encoder = LabelEncoder()
+             y = label_encoder.fit_transform(y)
+             class_names = label_encoder.classes_.astype(str).tolist()
+        else:
+             class_names = [str(c) for c in np.unique(y)]
+
+
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=data['testSize'], random_state=99, shuffle=True, stratify=y
         )
+
+        numerical_features = X_train.select_dtypes(include=np.number).columns.tolist()
+        categorical_features = X_train.select_dtypes(include=['object', 'category', 'bool']).columns.tolist()
+        print(f"Custom: Numerical features identified: {numerical_features}")
+        print(f"Custom: Categorical features identified: {categorical_features}")
+
+        # define numerical and categortical pipelines
+        # including imputation, log transformation and standardisation, as well as one-hot encoding for categorical features
+        numerical_pipeline = Pipeline([
+            ('imputer', SimpleImputer(strategy='mean')),
+            ('log_transformer', log_transformer_step),
+            ('scaler', StandardScaler())
+        ])
+        categorical_pipeline = Pipeline([
+            ('imputer', SimpleImputer(strategy='most_frequent')),
+            ('onehot', OneHotEncoder(handle_unknown='ignore', sparse_output=False))
+        ])
         
-        insights = create_model_insights(
-            model_to_evaluate,
-            feature_names=feature_names_for_vis,
-            model_type=data['modelType']
+        # set up transformers for numerical and categorical features
+        transformers = []
+        if numerical_features: transformers.append(('num', numerical_pipeline, numerical_features))
+        if categorical_features: transformers.append(('cat', categorical_pipeline, categorical_features))
+        if not transformers: raise ModelError("Custom: No numerical or categorical features identified.")
+
+        # create a preprocessor to apply transformations to the features
+        return {
+            'X': X, 'y': y, 'X_train': X_train, 'X_test': X_test, 'y_train': y_train, 'y_test': y_test,
+            'class_names': class_names,
+            'feature_names': None, # only known once the preprocessor is fitted
+            'preprocessor': ('preprocessor', ColumnTransformer(transformers=transformers, remainder='passthrough'))
+        }
+
+    else:
+        raise ModelError("Invalid dataset type specified")
+
+# initialise the model based on the specified type, hyperparameters can be overridden (as the sweep does)
+def create_model(data, **params):
+    if data['modelType'] == 'decision_tree':
+        return DecisionTreeClassifier(
+            min_samples_split=params.get('min_samples_split', data.get('minSamplesSplit', 2)),
+            random_state=99
         )
-        
-        train_cm = create_confusion_matrix(model_to_evaluate, X_train_final, y_train_actual, class_names_for_vis)
-        test_cm = create_confusion_matrix(model_to_evaluate, X_test_final, y_test_actual, class_names_for_vis)
-        
-        insights['confusion_matrices'] = {'train': train_cm, 'test': test_cm}
+    elif data['modelType'] == 'knn':
+        return KNeighborsClassifier(n_neighbors=params.get('n_neighbors', data.get('nNeighbors', 5)))
+    raise ModelError("Invalid modelType specified.")
+
+# average is weighted to account for class imbalance by averaging
+# zero division avoid errors when dealing with classes that are not predicted at all (which would cause a division by zero)
+def evaluation_metrics(y_true, y_pred):
+    return {
+        'accuracy': float(accuracy_score(y_true, y_pred)),
+        'precision': float(precision_score(y_true, y_pred, average='weighted', zero_division=0)),
+        'recall': float(recall_score(y_true, y_pred, average='weighted', zero_division=0)),
+        'f1': float(f1_score(y_true, y_pred, average='weighted', zero_division=0))
+    }
+
+# the metrics cross-validation reports, scored the same way as evaluation_metrics
+CV_SCORERS = {
+    'accuracy': make_scorer(accuracy_score),
+    'precision': make_scorer(precision_score, average='weighted', zero_division=0),
+    'recall': make_scorer(recall_score, average='weighted', zero_division=0),
+    'f1': make_scorer(f1_score, average='weighted', zero_division=0)
+}
+
+# read the number of cross-validation folds from the request, or None when cross-validation is not asked for
+def cross_validation_folds(data):
+    folds = data.get('cvFolds')
+    if folds in (None, 0, False):
+        return None
+    if not isinstance(folds, int) or isinstance(folds, bool) or not 2 <= folds <= TRAINING_CV_MAX_FOLDS:
+        raise ModelError(f"Cross-validation folds (cvFolds) must be a whole number from 2 to {TRAINING_CV_MAX_FOLDS}")
+    return folds
+
+# score the pipeline with k-fold cross-validation over the whole dataset, fitting the folds in parallel processes
+# the preprocessing is part of the pipeline, so it is fitted on each fold's training data only
+# folds are stratified when every class has enough samples for it, and the mean and standard deviation of each metric are returned
+def cross_validate_model(pipeline, X, y, folds):
+    _, class_counts = np.unique(y, return_counts=True)
+    if len(y) < folds:
+        raise ModelError(f"Cross-validation needs at least {folds} samples for {folds} folds")
+    if class_counts.min() >= folds:
+        strategy, splitter = 'stratified', StratifiedKFold(n_splits=folds, shuffle=True, random_state=99)
+    else:
+        strategy, splitter = 'kfold', KFold(n_splits=folds, shuffle=True, random_state=99)
+
+    # the worker processes memory-map the data from one shared file rather than each receiving a copy
+    n_jobs = min(folds, TRAINING_CV_JOBS if TRAINING_CV_JOBS > 0 else os.cpu_count() or 1)
+    with parallel_config(backend='loky', max_nbytes=0, mmap_mode='r'):
+        scores = cross_validate(pipeline, X, y, cv=splitter, scoring=CV_SCORERS, return_train_score=True, n_jobs=n_jobs)
+
+    summary = {'folds': folds, 'strategy': strategy}
+    for split in ('train', 'test'):
+        summary[split] = {
+            name: {'mean': float(np.mean(scores[f'{split}_{name}'])), 'std': float(np.std(scores[f'{split}_{name}']))}
+            for name in CV_SCORERS
+        }
+    return summary
+
+# train the model and return the results, raising ModelError for invalid input
+# progress is an optional function called with the name of each stage and the fraction of the work done so far
+def run_training(data, progress=None):
+    def report_progress(stage, fraction):
+        if progress is not None:
+            progress(stage, fraction)
+
+    print("\nStarting Model Training")
+    report_progress('validating', 0.05)
+    validate_input_data(data)
+    cv_folds = cross_validation_folds(data)
+
+    # the same configuration always trains the same model, so return the cached results if present
+    cache_key = training_fingerprint(data)
+    cached_results = cached_training_results(cache_key)
+    if cached_results is not None:
+        print("Returning cached training results")
+        return cached_results
+
+    # split the data and set up the preprocessing, then add the model to make the pipeline
+    prepared = prepare_dataset(data)
+    X_train_final, X_test_final = prepared['X_train'], prepared['X_test']
+    y_train_actual, y_test_actual = prepared['y_train'], prepared['y_test']
+    class_names_for_vis = prepared['class_names']
+
+    model_to_evaluate = Pipeline([prepared['preprocessor'], ('model', create_model(data))])
+    print(f"Created pipeline: {model_to_evaluate.steps}")
+    print(f"Fitting {data['modelType']} pipeline on {data['dataset']} data...")
+    report_progress('fitting', 0.2)
+    model_to_evaluate.fit(X_train_final, y_train_actual)
+    print("Pipeline fitting complete.")
+
+    feature_names_for_vis = prepared['feature_names']
+    if feature_names_for_vis is None:
+        try:
+            # get feature names from the fitted preprocessor
+            preprocessor_fitted = model_to_evaluate.named_steps['preprocessor']
+            feature_names_for_vis = preprocessor_fitted.get_feature_names_out()
+            feature_names_for_vis = [str(name) for name in feature_names_for_vis]
+            print(f"Custom: Transformed names ({len(feature_names_for_vis)}): {list(feature_names_for_vis)[:15]}...")
+        except Exception as name_err:
+            print(f"Could not get transformed feature names for custom data: {name_err}")
+            final_estimator = model_to_evaluate.named_steps['model']
+            if hasattr(final_estimator, 'n_features_in_'):
+                 feature_names_for_vis = [f'feature_{i}' for i in range(final_estimator.n_features_in_)]
+
+    # calculate the metrics for the training and testing sets
+    print("Calculating metrics...")
+    report_progress('evaluating', 0.5)
+    print(f"Evaluation: Using model/pipeline object of type: {type(model_to_evaluate)}")
+    y_train_pred = model_to_evaluate.predict(X_train_final)
+    y_test_pred = model_to_evaluate.predict(X_test_final)
+
+    metrics = {
+        'train': evaluation_metrics(y_train_actual, y_train_pred),
+        'test': evaluation_metrics(y_test_actual, y_test_pred)
+    }
+
+    # cross-validation gives the spread of each metric across folds, as one split can be noisy on small datasets
+    if cv_folds:
+        print(f"Cross-validating over {cv_folds} folds...")
+        report_progress('cross-validating', 0.55)
+        metrics['cross_validation'] = cross_validate_model(clone(model_to_evaluate), prepared['X'], prepared['y'], cv_folds)
+    
+    # create the visualisation and insights
+    print("Generating visualisations and insights...")
+    report_progress('visualising', 0.6)
+    # decision trees are exported as json, and kept so the svg can be drawn when it is first requested
+    visualisation_result = None
+    tree_export = None
+    tree_model = pipeline_model(model_to_evaluate)
+    if data['modelType'] == 'decision_tree' and isinstance(tree_model, DecisionTreeClassifier):
+        tree_id = cache_key[:32]
+        tree_export = export_tree(tree_model, feature_names_for_vis, class_names_for_vis)
+        save_tree_for_rendering(tree_id, tree_model, feature_names_for_vis, class_names_for_vis)
+        visualisation_result = f"/api/train-model/tree/{tree_id}.svg"
+    
+    insights = create_model_insights(
+        model_to_evaluate,
+        feature_names=feature_names_for_vis,
+        model_type=data['modelType']
+    )
+    
+    report_progress('confusion matrices', 0.85)
+    # the predictions made for the metrics are reused, the model's classes keep the rows in the same order as the class names
+    class_labels = pipeline_model(model_to_evaluate).classes_
+    train_cm = create_confusion_matrix(y_train_actual, y_train_pred, class_labels, class_names_for_vis)
+    test_cm = create_confusion_matrix(y_test_actual, y_test_pred, class_labels, class_names_for_vis)
+    
+    insights['confusion_matrices'] = {'train': train_cm, 'test': test_cm}
 
-        print("\nModel Training Complete")
-        
-        results = { 'metrics': metrics, 'visualisation_url': visualisation_result, 'insights': insights }
-        
-        # encode the results as a json object
+    print("\nModel Training Complete")
+    
+    results = { 'metrics': metrics, 'visualisation_url': visualisation_result, 'tree': tree_export, 'insights': insights }
+    
+    # encode the results as a json object
+    try:
+        results = json.loads(json.dumps(results, default=str))
+    except Exception as e:
+        print(f"Error encoding response data: {str(e)}")
+        traceback.print_exc()
+        raise RuntimeError('Error encoding response data') from e
+    
+    print(f"Response includes visualisation: {'visualisation_url' in results and results['visualisation_url'] is not None}")
+    store_training_results(cache_key, model_to_evaluate, results)
+    return results
+
+# the hyperparameter each model type sweeps over, as named in the request and in sklearn
+SWEEP_PARAMETERS = {
+    'decision_tree': ('minSamplesSplit', 'min_samples_split', 2),
+    'knn': ('nNeighbors', 'n_neighbors', 1)
+}
+
+# read the values to try from the request, either a list of values or a range with a start, stop and step (the stop is included)
+def sweep_values(data):
+    name, _, minimum = SWEEP_PARAMETERS[data['modelType']]
+    spec = data.get('sweep')
+    if isinstance(spec, list):
+        values = spec
+    elif isinstance(spec, dict):
         try:
-            results = json.loads(json.dumps(results, default=str))
-        except Exception as e:
-            print(f"Error encoding response data: {str(e)}")
-            traceback.print_exc()
-            return jsonify({'error': 'Error encoding response data'}), 500
-        
-        print(f"Response includes visualisation: {'visualisation_url' in results and results['visualisation_url'] is not None}")
-        return results
-        
+            start, stop, step = int(spec['start']), int(spec['stop']), int(spec.get('step', 1))
+        except (KeyError, TypeError, ValueError):
+            raise ModelError("Sweep must have whole number 'start' and 'stop' values, and optionally a 'step'")
+        if step < 1:
+            raise ModelError("Sweep step must be at least 1")
+        values = list(range(start, stop + 1, step))
+    else:
+        raise ModelError(f"A sweep of {name} values is required, as a list or a start, stop and step")
+
+    if not all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        raise ModelError(f"Sweep values for {name} must be whole numbers")
+    values = sorted(set(values))
+    if not values:
+        raise ModelError("Sweep must include at least one value")
+    if values[0] < minimum:
+        raise ModelError(f"Sweep values for {name} must be at least {minimum}")
+    if len(values) > TRAINING_SWEEP_MAX_VALUES:
+        raise ModelError(f"Sweep can try at most {TRAINING_SWEEP_MAX_VALUES} values")
+    return values
+
+# fit and score one decision tree on data that has already been preprocessed, this runs in a worker process
+def evaluate_tree(X_train, y_train, X_test, y_test, min_samples_split):
+    model = DecisionTreeClassifier(min_samples_split=min_samples_split, random_state=99).fit(X_train, y_train)
+    return {
+        'train': evaluation_metrics(y_train, model.predict(X_train)),
+        'test': evaluation_metrics(y_test, model.predict(X_test))
+    }
+
+# predict with every k at once from one neighbour query at the largest k
+# the votes of the nearest k neighbours are a running total along each row, and a tie goes to the first class, as in sklearn
+# when the kth and next nearest neighbours are the same distance away (allowing for rounding) which of them sklearn counts
+# depends on how it searched, so for those k a model is fitted and used as training would, to report the same metrics
+def knn_predictions_for_each_k(model, X_train, y_train, X, ks):
+    n_neighbours = min(max(ks) + 1, len(y_train)) # one more than the largest k, to see ties at its edge
+    distances, neighbours = model.kneighbors(X, n_neighbors=n_neighbours)
+    neighbour_classes = np.searchsorted(model.classes_, y_train)[neighbours] # the class index of each neighbour, nearest first
+    votes = np.cumsum(np.eye(len(model.classes_), dtype=np.int32)[neighbour_classes], axis=1)
+
+    predictions = {}
+    for k in ks:
+        if k < n_neighbours and np.isclose(distances[:, k - 1], distances[:, k]).any():
+            predictions[k] = KNeighborsClassifier(n_neighbors=k).fit(X_train, y_train).predict(X)
+        else:
+            predictions[k] = model.classes_[votes[:, k - 1, :].argmax(axis=1)]
+    return predictions
+
+# train and score the model for each value of its hyperparameter, preprocessing the data only once
+def run_sweep(data):
+    validate_input_data(data)
+    name, param, _ = SWEEP_PARAMETERS[data['modelType']]
+    values = sweep_values(data)
+
+    prepared = prepare_dataset(data)
+    preprocessor = prepared['preprocessor'][1]
+    X_train = preprocessor.fit_transform(prepared['X_train'], prepared['y_train'])
+    X_test = preprocessor.transform(prepared['X_test'])
+    y_train, y_test = np.asarray(prepared['y_train']), np.asarray(prepared['y_test'])
+    print(f"Sweeping {name} over {values} for {data['modelType']}...")
+
+    if data['modelType'] == 'knn':
+        if values[-1] > len(y_train):
+            raise ModelError(f"Number of neighbors cannot be more than the {len(y_train)} training samples")
+        model = KNeighborsClassifier(n_neighbors=values[-1]).fit(X_train, y_train)
+        train_predictions = knn_predictions_for_each_k(model, X_train, y_train, X_train, values)
+        test_predictions = knn_predictions_for_each_k(model, X_train, y_train, X_test, values)
+        scores = [{
+            'train': evaluation_metrics(y_train, train_predictions[k]),
+            'test': evaluation_metrics(y_test, test_predictions[k])
+        } for k in values]
+    else:
+        # each tree is independent, so they are fitted across processes
+        scores = Parallel(n_jobs=min(TRAINING_SWEEP_JOBS if TRAINING_SWEEP_JOBS > 0 else os.cpu_count() or 1, len(values)))(
+            delayed(evaluate_tree)(X_train, y_train, X_test, y_test, value) for value in values
+        )
+
+    results = [{'value': value, **score} for value, score in zip(values, scores)]
+    best = max(results, key=lambda result: (result['test']['accuracy'], result['test']['f1']))
+    return {'parameter': name, 'values': values, 'results': results, 'best': {'value': best['value'], 'test': best['test']}}
+
+# train the model, returning the results or an error response
+def train_model(data):
+    try:
+        return run_training(data)
+    except DatasetNotFoundError as e:
+         print(f"Model training error: {str(e)}")
+         return jsonify({'error': str(e)}), 404
     except ModelError as e:
          print(f"Model training error: {str(e)}")
          traceback.print_exc()
@@ -458,10 +775,59 @@ def register_model_training_routes(app):
         try:
             data = request.get_json()
             result = train_model(data)
+            if isinstance(result, tuple): # an error response
+                return result
             return jsonify(result), 200
         except ModelError as me:
              return jsonify({"error": str(me)}), 400
         except Exception as e:
             print(f"Unhandled exception in /api/train-model: {str(e)}")
             traceback.print_exc()
-            return jsonify({"error": "An unexpected server error occurred"}), 500
\ No newline at end of file
+            return jsonify({"error": "An unexpected server error occurred"}), 500
+
+    # train and score the model for a range of hyperparameter values, returning a grid of metrics
+    @app.route('/api/train-model/sweep', methods=['POST'])
+    def handle_sweep_route():
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "A JSON body with the training parameters is required"}), 400
+        try:
+            return jsonify(run_sweep(data)), 200
+        except DatasetNotFoundError as de:
+            return jsonify({"error": str(de)}), 404
+        except ModelError as me:
+            return jsonify({"error": str(me)}), 400
+        except Exception as e:
+            print(f"Unhandled exception in /api/train-model/sweep: {str(e)}")
+            traceback.print_exc()
+            return jsonify({"error": "An unexpected server error occurred"}), 500
+
+    # draw a trained decision tree as an svg, the first request for each tree draws it and later requests reuse the file
+    @app.route('/api/train-model/tree/<tree_id>.svg', methods=['GET'])
+    def handle_tree_svg_route(tree_id):
+        if not re.fullmatch(r'[0-9a-f]{32}', tree_id):
+            return jsonify({"error": "Tree not found"}), 404
+        try:
+            svg_path = render_tree_svg(tree_id)
+        except Exception as e:
+            print(f"Error drawing the tree visualisation: {str(e)}")
+            traceback.print_exc()
+            return jsonify({"error": "The tree visualisation could not be drawn"}), 500
+        if svg_path is None:
+            return jsonify({"error": "Tree not found, please train the model again"}), 404
+        return send_file(svg_path, mimetype='image/svg+xml', max_age=3600)
+
+    # draw a confusion matrix as a png, the first request for each matrix draws it and later requests reuse the file
+    @app.route('/api/train-model/confusion-matrix/<matrix_id>.png', methods=['GET'])
+    def handle_confusion_matrix_route(matrix_id):
+        if not re.fullmatch(r'[0-9a-f]{32}', matrix_id):
+            return jsonify({"error": "Confusion matrix not found"}), 404
+        try:
+            png_path = render_confusion_matrix_png(matrix_id)
+        except Exception as e:
+            print(f"Error drawing the confusion matrix: {str(e)}")
+            traceback.print_exc()
+            return jsonify({"error": "The confusion matrix could not be drawn"}), 500
+        if png_path is None:
+            return jsonify({"error": "Confusion matrix not found, please train the model again"}), 404
+        return send_file(png_path, mimetype='image/png', max_age=3600)
@@ -0,0 +1,135 @@
+# this script packs the downloaded models into one bundle for fast, offline startup
+# each model is saved with safetensors weights (which are memory-mapped when loading), its processor files and,
+# for the text model, a pre-built tokenizer.json, and a manifest records the checksum of every file
+#
+# usage: python routes/pack_models.py            (pack saved_models into saved_models/bundle)
+#        python routes/pack_models.py --verify   (check an existing bundle against its manifest)
+
+import os
+import sys
+import json
+import shutil
+import argparse
+from datetime import datetime, timezone
+
+# allow the routes package to be imported when this file is run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transformers import AutoImageProcessor, AutoModelForImageClassification
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from transformers import AutoFeatureExtractor, AutoModelForAudioClassification
+
+from routes.model_bundle import BUNDLE_FORMAT, MANIFEST_NAME, file_sha256, files_revision, read_manifest, verify_bundle
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "saved_models")
+
+# where each model and its processor were saved by download_models.py, and the classes used to load them
+SOURCES = {
+    'face': ("face_emotion_model", "face_emotion_processor", AutoModelForImageClassification, AutoImageProcessor),
+    'text': ("text_emotion_model", "text_emotion_tokenizer", AutoModelForSequenceClassification, AutoTokenizer),
+    'audio': ("audio_emotion_model", "audio_emotion_extractor", AutoModelForAudioClassification, AutoFeatureExtractor)
+}
+
+
+# the huggingface name the model was downloaded from, as recorded in its config
+def model_source(model_dir):
+    try:
+        with open(os.path.join(model_dir, "config.json")) as f:
+            return json.load(f).get('_name_or_path') or None
+    except (OSError, ValueError):
+        return None
+
+
+# save one model and its processor into the bundle folder, returning its manifest entry
+def pack_model(modality, models_dir, output_dir):
+    model_name, processor_name, model_class, processor_class = SOURCES[modality]
+    model_dir = os.path.join(models_dir, model_name)
+    processor_dir = os.path.join(models_dir, processor_name)
+    if not (os.path.exists(model_dir) and os.path.exists(processor_dir)):
+        raise FileNotFoundError(f"The {modality} model was not found in {models_dir}. Please run download_models.py first.")
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    model = model_class.from_pretrained(model_dir, local_files_only=True)
+    model.save_pretrained(output_dir, safe_serialization=True)
+    del model
+
+    if processor_class is AutoTokenizer:
+        # the fast tokenizer saved as tokenizer.json alone, so it is not rebuilt from the vocabulary files on every start
+        processor = AutoTokenizer.from_pretrained(processor_dir, local_files_only=True, use_fast=True)
+        processor.save_pretrained(output_dir, legacy_format=False)
+    else:
+        processor = processor_class.from_pretrained(processor_dir, local_files_only=True)
+        processor.save_pretrained(output_dir)
+
+    files = {}
+    for name in sorted(os.listdir(output_dir)):
+        path = os.path.join(output_dir, name)
+        files[name] = {'size': os.path.getsize(path), 'sha256': file_sha256(path)}
+
+    return {
+        'model_class': model_class.__name__,
+        'source': model_source(model_dir),
+        'revision': files_revision(files),
+        'files': files
+    }
+
+
+# pack every model into a new bundle, replacing the old bundle only once the new one is complete
+def pack_bundle(models_dir, bundle_dir):
+    temp_dir = bundle_dir + ".tmp"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'models': {}
+    }
+    for modality in SOURCES:
+        print(f"Packing the {modality} model...")
+        manifest['models'][modality] = pack_model(modality, models_dir, os.path.join(temp_dir, modality))
+
+    with open(os.path.join(temp_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(bundle_dir, ignore_errors=True)
+    os.rename(temp_dir, bundle_dir)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack the downloaded emotion models into a checksummed bundle")
+    parser.add_argument('--models-dir', default=MODELS_DIR, help="folder the models were downloaded to")
+    parser.add_argument('--output', help="folder to write the bundle to (default: <models-dir>/bundle)")
+    parser.add_argument('--verify', action='store_true', help="check an existing bundle against its manifest instead of packing")
+    args = parser.parse_args()
+
+    bundle_dir = args.output or os.path.join(args.models_dir, "bundle")
+
+    try:
+        if args.verify:
+            manifest = read_manifest(bundle_dir)
+            if manifest is None:
+                print(f"No bundle found in {bundle_dir}", file=sys.stderr)
+                sys.exit(1)
+            problems = verify_bundle(bundle_dir, manifest, full=True)
+            for problem in problems:
+                print(problem, file=sys.stderr)
+            if problems:
+                sys.exit(1)
+            print(f"Bundle in {bundle_dir} matches its manifest")
+            return
+
+        manifest = pack_bundle(args.models_dir, bundle_dir)
+        for modality, entry in manifest['models'].items():
+            print(f"{modality}: revision {entry['revision']} ({len(entry['files'])} files)")
+        print(f"Bundle saved to: {os.path.abspath(bundle_dir)}")
+
+    except Exception as e:
+        print(f"Error packing models: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
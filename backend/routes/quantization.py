@@ -0,0 +1,39 @@
+# this script converts the emotion models to a lower precision for faster inference on cpu
+# int8 uses dynamic quantization of the linear layers, bf16 converts all the weights to bfloat16
+
+import torch
+
+SUPPORTED_PRECISIONS = ('fp32', 'int8', 'bf16')
+
+
+# convert a loaded model to the requested precision, the model is changed in place to avoid holding two copies
+def apply_precision(model, precision='fp32'):
+    precision = (precision or 'fp32').lower()
+    if precision not in SUPPORTED_PRECISIONS:
+        raise ValueError(f"Unsupported inference precision '{precision}', use one of {', '.join(SUPPORTED_PRECISIONS)}")
+
+    model.eval()
+    if precision == 'int8':
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif precision == 'bf16':
+        model = model.to(torch.bfloat16)
+    return model
+
+
+# get the dtype the model expects for floating point inputs
+def model_input_dtype(model):
+    for param in model.parameters():
+        if param.is_floating_point():
+            return param.dtype
+    return torch.float32
+
+
+# cast the floating point inputs (pixel values, audio values) to the model's dtype, leaving token ids and masks alone
+def cast_inputs(inputs, model):
+    dtype = model_input_dtype(model)
+    if dtype == torch.float32:
+        return inputs
+    return {
+        key: value.to(dtype) if torch.is_tensor(value) and value.is_floating_point() else value
+        for key, value in inputs.items()
+    }
@@ -0,0 +1,61 @@
+# this script provides a bounded cache for results, keyed by a hash of the input
+# entries are dropped when the cache is full (least recently used first) or when they are older than the time to live
+
+import hashlib
+import threading
+from cachetools import TTLCache
+
+
+# build a cache key from a hash of the given parts, each part can be bytes or a string
+def make_cache_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'little')) # the length stops different splits of the same bytes from colliding
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl) if maxsize > 0 else None # a size of 0 turns the cache off
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # get a cached result, or None if it is not cached
+    def get(self, key):
+        with self._lock:
+            value = self._cache.get(key) if self._cache is not None else None
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self._cache is None:
+            return
+        with self._lock:
+            self._cache[key] = value
+
+    def clear(self):
+        if self._cache is None:
+            return
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._cache) if self._cache is not None else 0,
+                'maxsize': self.maxsize,
+                'ttl': self.ttl
+            }
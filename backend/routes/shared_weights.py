@@ -0,0 +1,106 @@
+# this script loads model weights by memory-mapping the safetensors files instead of reading them into memory
+# the pages are private copy-on-write mappings of the file, so when the app is loaded before gunicorn forks its workers
+# every worker reads the same physical copy of the weights from the page cache
+
+import os
+import re
+import json
+import struct
+import torch
+from transformers import AutoConfig
+from transformers.modeling_utils import no_init_weights
+
+SAFETENSORS_DTYPES = {
+    'F64': torch.float64, 'F32': torch.float32, 'F16': torch.float16, 'BF16': torch.bfloat16,
+    'I64': torch.int64, 'I32': torch.int32, 'I16': torch.int16, 'I8': torch.int8,
+    'U8': torch.uint8, 'BOOL': torch.bool
+}
+
+
+# read the json header of a safetensors file, returning it with the byte offset where the tensor data starts
+def read_safetensors_header(path):
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop('__metadata__', None)
+    return header, 8 + header_size
+
+
+# load every tensor in a safetensors file as a view onto one memory-mapped storage, nothing is copied
+def load_mmap_state_dict(path):
+    header, data_start = read_safetensors_header(path)
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    raw = torch.empty(0, dtype=torch.uint8).set_(storage)
+
+    state_dict = {}
+    for name, info in header.items():
+        begin, end = info['data_offsets']
+        dtype = SAFETENSORS_DTYPES[info['dtype']]
+        data = raw[data_start + begin:data_start + end]
+        try:
+            tensor = data.view(dtype)
+        except RuntimeError:
+            tensor = data.clone().view(dtype) # a tensor not aligned to its element size has to be copied
+        state_dict[name] = tensor.reshape(info['shape'])
+    return state_dict
+
+
+# find the safetensors files for a saved model, including sharded checkpoints
+def find_safetensors_files(model_dir):
+    index_path = os.path.join(model_dir, 'model.safetensors.index.json')
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            shards = sorted(set(json.load(f)['weight_map'].values()))
+        return [os.path.join(model_dir, shard) for shard in shards]
+
+    single_path = os.path.join(model_dir, 'model.safetensors')
+    if os.path.exists(single_path):
+        return [single_path]
+    raise FileNotFoundError(f"No safetensors weights found in {model_dir}. Re-run download_models.py to save them.")
+
+
+# point the parameters of a model at memory-mapped weights instead of copying them in
+def attach_mmap_weights(model, paths):
+    state_dict = {}
+    for path in paths:
+        state_dict.update(load_mmap_state_dict(path))
+
+    result = model.load_state_dict(state_dict, strict=False, assign=True)
+    if result.unexpected_keys:
+        print(f"Warning: unexpected weights ignored: {result.unexpected_keys[:5]}")
+    model.tie_weights()
+
+    # the model was built without initialising its weights, so any weight the files do not provide would be left as
+    # whatever happened to be in memory, the only weights allowed to be missing are ones tied to a loaded weight
+    # and ones the model class itself says can be missing
+    missing = untied_missing_keys(model, result.missing_keys, state_dict)
+    if missing:
+        raise RuntimeError(f"The saved weights are missing {len(missing)} tensors the model needs "
+                           f"(for example {missing[:5]}). Re-run download_models.py to save them.")
+    return model.eval()
+
+
+# the missing keys that are neither tied to a loaded weight nor allowed to be missing by the model class
+def untied_missing_keys(model, missing_keys, state_dict):
+    ignore_patterns = getattr(model, '_keys_to_ignore_on_load_missing', None) or []
+    loaded = {tensor.data_ptr() for tensor in state_dict.values()}
+    tensors = dict(model.named_parameters(remove_duplicate=False))
+    tensors.update(model.named_buffers(remove_duplicate=False))
+
+    missing = []
+    for key in missing_keys:
+        if any(re.search(pattern, key) for pattern in ignore_patterns):
+            continue
+        tensor = tensors.get(key)
+        if tensor is not None and tensor.data_ptr() in loaded: # tied to a weight that was loaded
+            continue
+        missing.append(key)
+    return missing
+
+
+# build a model from its config without initialising random weights, then attach the memory-mapped weights
+def load_model_with_shared_weights(model_class, model_dir):
+    config = AutoConfig.from_pretrained(model_dir, local_files_only=True)
+    with no_init_weights():
+        model = model_class.from_config(config)
+    return attach_mmap_weights(model, find_safetensors_files(model_dir))
@@ -0,0 +1,263 @@
+# this script runs model training as background jobs, so the web threads are not blocked while a model is fitted
+# jobs run in a pool of separate processes (so training can use several cores), and their status, progress and results
+# are kept in files, so any gunicorn worker can answer for any job
+#
+# clients should poll the status url (about once a second) until the job has finished, then fetch the result url
+# the server-sent events url is there for clients that want pushed updates, but each open stream holds a web thread,
+# so streams are closed after a short time and the client reconnects (which browsers' EventSource does by itself)
+
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import tempfile
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import threading
+from flask import request, jsonify, Response, stream_with_context
+
+from routes.model_training import (ModelError, DatasetNotFoundError, run_training, validate_input_data,
+                                   training_fingerprint, cached_training_results)
+
+# where the job files are kept, this should be shared by every gunicorn worker
+TRAINING_JOBS_DIR = os.environ.get("TRAINING_JOBS_DIR", os.path.join(tempfile.gettempdir(), "training_jobs"))
+
+# the number of training processes, how many jobs can wait for one, and how long finished jobs are kept
+TRAINING_JOB_WORKERS = int(os.environ.get("TRAINING_JOB_WORKERS", 2))
+TRAINING_JOB_MAX_PENDING = int(os.environ.get("TRAINING_JOB_MAX_PENDING", 16))
+TRAINING_JOB_TTL_SECONDS = float(os.environ.get("TRAINING_JOB_TTL_SECONDS", 3600))
+
+# how often the event stream checks for progress, how long it stays open before the client has to reconnect,
+# and how long the client is told to wait before reconnecting
+TRAINING_JOB_EVENTS_INTERVAL = float(os.environ.get("TRAINING_JOB_EVENTS_INTERVAL", 0.5))
+TRAINING_JOB_EVENTS_TIMEOUT = float(os.environ.get("TRAINING_JOB_EVENTS_TIMEOUT", 15))
+TRAINING_JOB_EVENTS_RETRY_MS = int(os.environ.get("TRAINING_JOB_EVENTS_RETRY_MS", 1000))
+
+FINISHED_STATES = ('finished', 'failed')
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_pending = set() # ids of the jobs this process has submitted that have not finished yet
+
+
+# raised when too many jobs are already waiting
+class TrainingQueueFull(Exception):
+    pass
+
+
+def job_dir(job_id, jobs_dir=TRAINING_JOBS_DIR):
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id or ''):
+        raise KeyError(job_id) # ids are generated by us, so anything else cannot be a job
+    return os.path.join(jobs_dir, job_id)
+
+
+# write json to a temporary file and then move it into place, so readers never see a half written file
+def write_json(path, data):
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, default=str)
+    os.replace(temp_path, path)
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# get the status of a job, or None if there is no such job
+def read_status(job_id):
+    try:
+        return read_json(os.path.join(job_dir(job_id), 'status.json'))
+    except KeyError:
+        return None
+
+
+def update_status(directory, **changes):
+    path = os.path.join(directory, 'status.json')
+    status = read_json(path) or {}
+    status.update(changes, updated=time.time())
+    write_json(path, status)
+    return status
+
+
+# run a training job, this is called in one of the pool's processes
+def run_job(job_id, data, jobs_dir):
+    directory = job_dir(job_id, jobs_dir)
+
+    def progress(stage, fraction):
+        update_status(directory, status='running', stage=stage, progress=round(fraction, 3))
+
+    try:
+        update_status(directory, status='running', stage='starting', started=time.time())
+        results = run_training(data, progress)
+        write_json(os.path.join(directory, 'result.json'), results)
+        update_status(directory, status='finished', stage='finished', progress=1.0, finished=time.time())
+    except ModelError as e:
+        code = 404 if isinstance(e, DatasetNotFoundError) else 400
+        update_status(directory, status='failed', error=str(e), code=code, finished=time.time())
+    except Exception as e:
+        print(f"Error in training job {job_id}: {str(e)}")
+        traceback.print_exc()
+        update_status(directory, status='failed', error='An unexpected server error occurred during model training.',
+                      code=500, finished=time.time())
+
+
+# the process pool is created on first use (and again in a forked worker, which cannot use its parent's pool)
+# processes are spawned rather than forked, as forking a threaded web server is not safe
+def get_pool(replace=False):
+    global _pool, _pool_pid
+    with _pool_lock:
+        if replace or _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=max(1, TRAINING_JOB_WORKERS),
+                                        mp_context=multiprocessing.get_context('spawn'))
+            _pool_pid = os.getpid()
+            _pending.clear()
+        return _pool
+
+
+# delete the files of jobs that have not been updated for longer than the time to live
+# as well as finished jobs, this removes jobs left queued or running when the worker that owned them was restarted,
+# since a job that is still running updates its status at every stage
+def remove_expired_jobs():
+    if not os.path.isdir(TRAINING_JOBS_DIR):
+        return
+    cutoff = time.time() - TRAINING_JOB_TTL_SECONDS
+    for job_id in os.listdir(TRAINING_JOBS_DIR):
+        status = read_status(job_id)
+        if status is not None and status.get('updated', 0) < cutoff:
+            shutil.rmtree(os.path.join(TRAINING_JOBS_DIR, job_id), ignore_errors=True)
+
+
+# validate a training request and queue it, returning the new job's id
+def submit_training_job(data):
+    validate_input_data(data) # reject invalid requests straight away rather than in the job
+    cached_results = cached_training_results(training_fingerprint(data))
+    if cached_results is None and len(_pending) >= TRAINING_JOB_MAX_PENDING:
+        raise TrainingQueueFull('Too many training jobs are waiting, please try again shortly')
+
+    remove_expired_jobs()
+    job_id = uuid.uuid4().hex
+    directory = job_dir(job_id)
+    os.makedirs(directory)
+
+    # the same configuration was trained before (by any worker), so the job is finished without using the pool
+    if cached_results is not None:
+        write_json(os.path.join(directory, 'result.json'), cached_results)
+        now = time.time()
+        update_status(directory, id=job_id, status='finished', stage='finished', progress=1.0,
+                      created=now, started=now, finished=now)
+        return job_id
+
+    update_status(directory, id=job_id, status='queued', stage='queued', progress=0.0, created=time.time())
+
+    try:
+        future = get_pool().submit(run_job, job_id, data, TRAINING_JOBS_DIR)
+    except BrokenProcessPool:
+        # a training process died (for example it ran out of memory), which stops the whole pool, so start a new one
+        future = get_pool(replace=True).submit(run_job, job_id, data, TRAINING_JOBS_DIR)
+    _pending.add(job_id)
+
+    def done(finished_future):
+        _pending.discard(job_id)
+        error = finished_future.exception()
+        if error is not None: # the job never ran to completion, for example because its process was killed
+            print(f"Training job {job_id} could not be run: {error}")
+            update_status(directory, status='failed', error='The training job could not be run.', code=500)
+
+    future.add_done_callback(done)
+    return job_id
+
+
+def job_urls(job_id):
+    return {
+        'status_url': f'/api/train-model/jobs/{job_id}',
+        'events_url': f'/api/train-model/jobs/{job_id}/events',
+        'result_url': f'/api/train-model/jobs/{job_id}/result'
+    }
+
+
+def job_not_found():
+    return jsonify({'error': 'Training job not found'}), 404
+
+
+# register the training job routes
+def register_training_job_routes(app):
+    # start a training job, the response has the job id and where to follow it
+    @app.route('/api/train-model/jobs', methods=['POST'])
+    def submit_train_model_job():
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'A JSON body with the training parameters is required'}), 400
+        try:
+            job_id = submit_training_job(data)
+        except ModelError as e:
+            return jsonify({'error': str(e)}), 400
+        except TrainingQueueFull as e:
+            return jsonify({'error': str(e)}), 429
+        except Exception as e:
+            print(f"Error submitting training job: {str(e)}")
+            traceback.print_exc()
+            return jsonify({'error': 'An unexpected server error occurred'}), 500
+        status = read_status(job_id)['status'] # finished already if the results were cached
+        return jsonify({'job_id': job_id, 'status': status, **job_urls(job_id)}), 200 if status == 'finished' else 202
+
+    # get the status and progress of a job
+    @app.route('/api/train-model/jobs/<job_id>', methods=['GET'])
+    def get_train_model_job(job_id):
+        status = read_status(job_id)
+        if status is None:
+            return job_not_found()
+        return jsonify({**status, **job_urls(job_id)})
+
+    # stream the status of a job as server-sent events until it finishes, or until the stream times out and the client reconnects
+    # polling the status route is the main way to follow a job, as every open stream holds a web thread
+    @app.route('/api/train-model/jobs/<job_id>/events', methods=['GET'])
+    def stream_train_model_job(job_id):
+        if read_status(job_id) is None:
+            return job_not_found()
+
+        def generate():
+            last_status = None
+            deadline = time.monotonic() + TRAINING_JOB_EVENTS_TIMEOUT
+            yield f"retry: {TRAINING_JOB_EVENTS_RETRY_MS}\n\n"
+            while True:
+                status = read_status(job_id)
+                if status is None:
+                    yield f"event: failed\ndata: {json.dumps({'error': 'Training job not found'})}\n\n"
+                    return
+                if status != last_status:
+                    yield f"event: {status['status']}\ndata: {json.dumps(status)}\n\n"
+                    last_status = status
+                if status['status'] in FINISHED_STATES:
+                    return
+                if time.monotonic() > deadline:
+                    yield "event: timeout\ndata: {}\n\n" # the client reconnects (or polls the status instead)
+                    return
+                time.sleep(TRAINING_JOB_EVENTS_INTERVAL)
+
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+    # get the results of a finished job, or its status if it is still running
+    @app.route('/api/train-model/jobs/<job_id>/result', methods=['GET'])
+    def get_train_model_job_result(job_id):
+        status = read_status(job_id)
+        if status is None:
+            return job_not_found()
+        if status['status'] == 'failed':
+            return jsonify({'error': status.get('error')}), status.get('code', 500)
+        if status['status'] != 'finished':
+            return jsonify({**status, **job_urls(job_id)}), 202
+
+        results = read_json(os.path.join(job_dir(job_id), 'result.json'))
+        if results is None:
+            return job_not_found()
+        return jsonify(results), 200
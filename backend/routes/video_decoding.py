@@ -0,0 +1,92 @@
+# this script samples frames from an uploaded video with ffmpeg, already scaled to the size the face model needs
+# consecutive frames that barely change are skipped with a cheap perceptual diff, so only distinct frames are analysed
+
+import shutil
+import tempfile
+import threading
+import subprocess
+import numpy as np
+from PIL import Image
+
+from routes.audio_decoding import read_error_log # shared, so both decoders report ffmpeg's errors the same way
+
+# frames are compared on a small greyscale thumbnail of this many pixels a side
+SIGNATURE_SIZE = 16
+
+
+# raised when the video cannot be decoded
+class VideoDecodeError(Exception):
+    pass
+
+
+def ffmpeg_frames_command(path, fps, width, height):
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise VideoDecodeError('ffmpeg is required to decode video but it is not installed.')
+    # sample frames at the given rate, scale them to the model's input size and write them as raw rgb to stdout
+    return [ffmpeg, '-hide_banner', '-loglevel', 'error', '-i', path,
+            '-vf', f'fps={fps},scale={width}:{height}', '-f', 'rawvideo', '-pix_fmt', 'rgb24', 'pipe:1']
+
+
+# decode a video file, yielding the timestamp in seconds and the rgb pixels of each sampled frame
+# decoding stops (and ffmpeg is stopped) after max_frames frames, when the caller stops reading, or after timeout seconds (0 means no limit)
+# ffmpeg's messages go to a temporary file, as a pipe that is not read while the frames are being read fills up on a badly
+# damaged file and leaves ffmpeg (and the request) waiting forever
+def iter_video_frames(path, fps, width, height, max_frames=0, timeout=0):
+    error_log = tempfile.TemporaryFile()
+    process = subprocess.Popen(ffmpeg_frames_command(path, fps, width, height),
+                               stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=error_log)
+    timer = None
+    timed_out = threading.Event()
+    if timeout > 0:
+        def stop():
+            timed_out.set()
+            process.kill()
+        timer = threading.Timer(timeout, stop)
+        timer.daemon = True
+        timer.start()
+
+    frame_bytes = width * height * 3
+    count = 0
+    try:
+        while not max_frames or count < max_frames:
+            data = process.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                break
+            yield count / fps, np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+            count += 1
+
+        if timed_out.is_set():
+            raise VideoDecodeError(f"decoding the video took longer than {timeout:g} seconds")
+        if count == 0:
+            process.wait()
+            raise VideoDecodeError(f"ffmpeg could not decode the video: {read_error_log(error_log) or 'no frames found'}")
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        error_log.close()
+
+
+# a small greyscale thumbnail of a frame, used to tell whether two frames look different
+def frame_signature(frame):
+    thumbnail = Image.fromarray(frame).convert('L').resize((SIGNATURE_SIZE, SIGNATURE_SIZE), Image.BOX)
+    return np.asarray(thumbnail, dtype=np.float32)
+
+
+# the mean absolute difference between two signatures, from 0 (identical) to 255
+def signature_difference(a, b):
+    return float(np.abs(a - b).mean())
+
+
+# drop frames that look almost the same as the last frame kept, yielding the timestamp and pixels of each kept frame
+def iter_distinct_frames(frames, threshold):
+    last_signature = None
+    for timestamp, frame in frames:
+        signature = frame_signature(frame)
+        if last_signature is not None and signature_difference(signature, last_signature) <= threshold:
+            continue
+        last_signature = signature
+        yield timestamp, frame
@@ -52,7 +52,7 @@ const FileUploader = ({ onFileLoaded, onError }) => {
         const result = await uploadCSVFile(file);
         
         // get the properties from the result
-        const { data, features, suitable_targets, dropped_columns, all_columns } = result;
+        const { data, features, suitable_targets, dropped_columns, all_columns, dataset_id } = result;
         
         let successMessage = `Success! Found ${features.length} original features and ${data.length} rows.`;
         if (all_columns && all_columns.length > features.length) {
@@ -72,7 +72,7 @@ const FileUploader = ({ onFileLoaded, onError }) => {
         
         setDebugInfo(successMessage);
         
-        onFileLoaded?.(data, features);
+        onFileLoaded?.(data, features, dataset_id); // the dataset id lets training refer to the rows stored on the server
         
       } catch (error) {
         if (error.message && error.message.includes('Failed to fetch')) {
@@ -9,10 +9,16 @@ const MLUtilities = () => {
 };
 
 export const trainModel = async (params) => {
+  const { customData, ...paramsWithoutRows } = params;
   try {
-    const response = await apiService.post('/api/train-model', params);
+    // if the uploaded dataset is stored on the server, refer to it by its id rather than sending every row again
+    const response = await apiService.post('/api/train-model', params.datasetId ? paramsWithoutRows : params);
     return response.data;
   } catch (error) {
+    // the stored dataset may have expired, so send the rows instead
+    if (params.datasetId && customData && error.response?.status === 404) {
+      return trainModel({ ...params, datasetId: undefined });
+    }
     return { error: error.response?.data?.error || 'An error occurred while training the model' };
   }
 };
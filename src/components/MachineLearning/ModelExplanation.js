@@ -19,6 +19,9 @@ import {
 
 import { useTheme } from '@mui/material/styles';
 
+// the confusion matrix images are served by the backend
+import { backendUrl } from '../../services/APIService';
+
 const formatImportance = (value) => {
     return `${value.toFixed(2)}%`;
 };
@@ -181,9 +184,9 @@ const ModelExplanation = ({ explanations, loading }) => {
             </Box>
             <Box sx={{ pt: 2, display: 'flex', justifyContent: 'center' }}>
                 {/* if the confusion matrix is available, display it */}
-                {confusion_matrices[activeConfusionMatrix] ? (
+                {confusion_matrices[activeConfusionMatrix]?.image_url ? (
                      <img 
-                        src={`data:image/png;base64,${confusion_matrices[activeConfusionMatrix]}`}
+                        src={`${backendUrl}${confusion_matrices[activeConfusionMatrix].image_url}`}
                         alt={`${activeConfusionMatrix} confusion matrix`}
                         style={{ maxWidth: '100%', height: 'auto' }}
                      />
@@ -59,6 +59,7 @@ const MachineLearningPage = () => {
   const [nNeighbors, setNNeighbors] = useState(5);
 
   const [customData, setCustomData] = useState(null);
+  const [datasetId, setDatasetId] = useState(null);
   const [features, setFeatures] = useState([]);
   const [error, setError] = useState('');
   const [metrics, setMetrics] = useState(null);
@@ -103,11 +104,12 @@ const MachineLearningPage = () => {
   };
 
   // when the file is loaded, set the custom data and features
-  const handleFileLoaded = (data, fileFeatures) => {
+  const handleFileLoaded = (data, fileFeatures, fileDatasetId) => {
     console.log('File loaded with data:', data.length, 'rows');
     console.log('File features:', fileFeatures);
     
     setCustomData(data);
+    setDatasetId(fileDatasetId || null); // the id of the copy stored on the server, if it could be stored
     setFeatures(fileFeatures);
     setColumnsToDiscard([]);
     
@@ -161,6 +163,7 @@ const MachineLearningPage = () => {
     minSamplesSplit,
     nNeighbors,
     customData,
+    datasetId,
     targetFeature,
     selectedFeatures,
     targetWarning